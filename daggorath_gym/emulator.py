@@ -6,30 +6,85 @@ a simple start/stop/recv/send API.
     State channel:   named pipe (FIFO) — MAME writes, Python reads
     Command channel: TCP socket         — Python writes, MAME reads
 
-The state channel carries fixed-size tagged records (no delimiter):
-
-    S  + 23-byte frame                                 state only changed
-    T  + 1-byte comColor + 1024 pixel bytes            text only changed
-    B  + 23-byte frame + 1-byte comColor + 1024 px     both changed
-    M  + 1024-byte maze                                maze changed
-    C  + 128-byte creature array                       creatures changed
-    O  + 70-byte object record                         objects changed
-    H  + 24-byte holes/ladders record                  holes/ladders changed
+The state channel carries one envelope per emulated frame, plus one per
+snapshot save, snapshot load, and machine reset. A 16-byte header
+
+    "DG"  u8 version (3)  u8 events  u32 frame  u16 epoch  u16 channels
+    u16 payload length  u16 checksum
+
+is followed by each channel whose bit is set, in bit order (no delimiter):
+
+    0x01  23-byte frame                                 state changed
+    0x02  1-byte comColor + 1024 pixel bytes            text changed
+    0x04  1024-byte maze                                maze changed
+    0x08  128-byte creature array                       creatures changed
+    0x10  70-byte object record                         objects changed
+    0x20  24-byte holes/ladders record                  holes/ladders changed
+    0x40  4 x u32 LE                                    clock (every 60 frames)
+    0x80  1-byte flags                                  command settled
+    0x100 u8 count + count x (u8 slot, 4 bytes)         creature slots changed
+    0x200 u8 count + count x (u16 LE index, u8 byte)    maze cells changed
+
+The two delta channels stand in for the full creature or maze channel when
+they are smaller; the operator patches its last-known copy with them. The
+plugin still sends the full channel after a run of deltas, so a copy lost to
+a resync is restored.
+
+The events byte acknowledges a snapshot save (0x01), a snapshot load (0x02),
+or a machine reset (0x04), or marks a step end (0x08). Every reset and load
+begins a new epoch at frame 0: the operator forgets the last-known state at
+an epoch change, counts the frames missing between envelopes of one epoch,
+and measures how many frames behind the newest envelope each state is. The
+checksum is the 16-bit sum of the header bytes before it and the payload
+bytes; bytes that do not start a well-formed envelope are skipped up to the
+next "DG".
+
+Besides the command indices, the command channel carries control opcodes
+(0xF0 and up) that save or load a numbered machine snapshot slot and
+soft-reset the machine; the save, load, and reset events acknowledge them on
+the state channel. When steps are marked — lockstep, a fixed number of
+frames per step, or settle mode — each command byte (or the advance opcode)
+begins a step, and the step-end event rides on the envelope of the frame the
+step ended on. In lockstep the plugin also pauses the machine there until
+the next step begins. In settle mode a step ends once the game has run the
+command (or answered "???") and drawn a fresh prompt, and the settled
+channel on that envelope says whether the parser matched the command and
+whether the wait hit the plugin's frame cap. The clock channel times the
+emulator: screen frames, the frames each Lua notifier saw, and the host
+microseconds over its interval.
+
+With IpcConfig.shared_state_path set, the channels skip the FIFO: the plugin
+keeps each one's latest value at a fixed offset of a shared file (ideally on
+/dev/shm), under a sequence number that is odd while a write is in flight.
+The operator maps the file and copies out the channels that changed, retrying
+any copy the sequence number shows was torn. The envelopes then carry only
+the events and reports.
+
+IpcConfig.sampling_rates sets how often the plugin reads each channel; a
+channel read every N frames reports a change up to N - 1 frames late.
 """
 
+import array
+import fcntl
+import glob
+import itertools
+import mmap
 import os
 import select
 import socket
+import struct
 import subprocess
+import termios
 import time
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, fields
+from typing import NamedTuple, Optional
 
 from . import commands
 from .paths import PROJECT_PATH, ROM_PATH, HASH_PATH, PLUGINS_PATH
 from .screen import PIXEL_BYTES, decode_command_area
 from .state import (
     CREATURE_BYTES,
+    CREATURE_FIELDS,
     FRAME_LEN,
     HOLES_LADDERS_BYTES,
     MAZE_BYTES,
@@ -38,38 +93,281 @@ from .state import (
 )
 
 
-# Record sizes keyed by the one-byte tag (fixed-size framing, binary-safe).
-_RECORD_LENGTHS = {
-    b"S": 1 + FRAME_LEN,
-    b"T": 1 + 1 + PIXEL_BYTES,
-    b"B": 1 + FRAME_LEN + 1 + PIXEL_BYTES,
-    b"M": 1 + MAZE_BYTES,
-    b"C": 1 + CREATURE_BYTES,
-    b"O": 1 + OBJECTS_BYTES,
-    b"H": 1 + HOLES_LADDERS_BYTES,
+# Message envelope: magic, version, events, frame number, epoch, channel mask,
+# payload length, and the checksum over every byte before it and the payload.
+_MESSAGE_MAGIC = b"DG"
+_MESSAGE_VERSION = 3
+_MESSAGE_HEADER = struct.Struct("<2sBBIHHHH")
+_CHECKSUMMED_HEADER_BYTES = _MESSAGE_HEADER.size - 2
+
+# Clock report: screen frames, state and commands notifier calls, microseconds.
+_CLOCK_FORMAT = struct.Struct("<IIII")
+
+# Settle report: flags for the command that ended the step.
+_SETTLED_MATCHED = 0x01
+_SETTLED_CAPPED = 0x02
+
+# Channel bits, with their payload lengths in payload order.
+_CHANNEL_FRAME = 0x01
+_CHANNEL_TEXT = 0x02
+_CHANNEL_MAZE = 0x04
+_CHANNEL_CREATURES = 0x08
+_CHANNEL_OBJECTS = 0x10
+_CHANNEL_HOLES_LADDERS = 0x20
+_CHANNEL_CLOCK = 0x40
+_CHANNEL_SETTLED = 0x80
+_CHANNEL_LENGTHS = {
+    _CHANNEL_FRAME: FRAME_LEN,
+    _CHANNEL_TEXT: 1 + PIXEL_BYTES,
+    _CHANNEL_MAZE: MAZE_BYTES,
+    _CHANNEL_CREATURES: CREATURE_BYTES,
+    _CHANNEL_OBJECTS: OBJECTS_BYTES,
+    _CHANNEL_HOLES_LADDERS: HOLES_LADDERS_BYTES,
+    _CHANNEL_CLOCK: _CLOCK_FORMAT.size,
+    _CHANNEL_SETTLED: 1,
 }
 
-# Seconds to wait for the next state record before giving up.
+# Delta channels, after the fixed-length ones in payload order: a u8 entry
+# count, then that many entries, each replacing part of a full channel. The
+# plugin sends one only when it is shorter than the full channel.
+_CHANNEL_CREATURE_DELTA = 0x100
+_CHANNEL_MAZE_DELTA = 0x200
+_CREATURE_DELTA_ENTRY_BYTES = 1 + CREATURE_FIELDS
+_MAZE_DELTA_ENTRY = struct.Struct("<HB")
+_DELTA_CHANNELS = {
+    _CHANNEL_CREATURE_DELTA: (_CHANNEL_CREATURES, _CREATURE_DELTA_ENTRY_BYTES),
+    _CHANNEL_MAZE_DELTA: (_CHANNEL_MAZE, _MAZE_DELTA_ENTRY.size),
+}
+_DELTA_MAX_ENTRIES = 0xFF
+
+# Channels that carry game state; the rest report on the emulator.
+_STATE_CHANNELS = (
+    _CHANNEL_FRAME | _CHANNEL_TEXT | _CHANNEL_MAZE
+    | _CHANNEL_CREATURES | _CHANNEL_OBJECTS | _CHANNEL_HOLES_LADDERS
+    | _CHANNEL_CREATURE_DELTA | _CHANNEL_MAZE_DELTA
+)
+
+
+def _payload_length_bounds(mask: int) -> Optional[tuple[int, int]]:
+    """The shortest and longest payload a channel mask allows.
+
+    None if the mask names a channel twice, in full and as a delta.
+    """
+    shortest = longest = sum(
+        length for channel, length in _CHANNEL_LENGTHS.items() if mask & channel
+    )
+    for delta, (full, entry_bytes) in _DELTA_CHANNELS.items():
+        if mask & delta:
+            if mask & full:
+                return None
+            shortest += 1
+            longest += min(1 + _DELTA_MAX_ENTRIES * entry_bytes, _CHANNEL_LENGTHS[full] - 1)
+    return shortest, longest
+
+
+# The payload length bounds of each channel mask.
+_PAYLOAD_LENGTH_BOUNDS = tuple(
+    _payload_length_bounds(mask)
+    for mask in range(1 << (len(_CHANNEL_LENGTHS) + len(_DELTA_CHANNELS)))
+)
+
+# The largest envelope the plugin writes. A pipe with less room than this
+# free can block the emulator on the plugin's next write.
+_MESSAGE_MAX_BYTES = _MESSAGE_HEADER.size + max(
+    bounds[1] for bounds in _PAYLOAD_LENGTH_BOUNDS if bounds is not None
+)
+
+# Events: acknowledgements and step ends, carried in the header.
+_EVENT_SNAPSHOT_SAVED = 0x01
+_EVENT_SNAPSHOT_LOADED = 0x02
+_EVENT_MACHINE_RESET = 0x04
+_EVENT_STEP_ENDED = 0x08
+
+# Control opcodes, sent on the command channel above the 154 command indices.
+_CONTROL_SAVE_SNAPSHOT = 0xF0
+_CONTROL_LOAD_SNAPSHOT = 0xF1
+_CONTROL_RESTART_GAME = 0xF2
+_CONTROL_ADVANCE = 0xF3
+
+# Snapshot slots are numbered by one byte on the command channel.
+SNAPSHOT_SLOTS = 256
+
+# Seconds to wait for the next envelope before giving up.
 _STATE_READ_TIMEOUT = 30.0
 
+# The receive buffer is allocated once; every read wants at least a chunk
+# of free space behind the unread bytes.
+_RECEIVE_BUFFER_BYTES = 64 * 1024
+_READ_CHUNK_BYTES = 4096
+
+# Kernel pipe capacity where it cannot be queried (Linux's default).
+_DEFAULT_PIPE_CAPACITY = 64 * 1024
+
+# Shared-state file: u32 LE header words — sequence (odd mid-write), epoch
+# (bumped by each reset and load), the epoch the channels were written in,
+# and a generation per channel — then each channel at a fixed offset.
+_SHARED_HEADER = struct.Struct("<9I")
+_SHARED_SEQUENCE = struct.Struct("<I")
+_SHARED_CHANNELS = (
+    _CHANNEL_FRAME, _CHANNEL_TEXT, _CHANNEL_MAZE,
+    _CHANNEL_CREATURES, _CHANNEL_OBJECTS, _CHANNEL_HOLES_LADDERS,
+)
+_SHARED_CHANNEL_LENGTHS = tuple(_CHANNEL_LENGTHS[channel] for channel in _SHARED_CHANNELS)
+_SHARED_CHANNEL_OFFSETS = tuple(
+    itertools.accumulate(_SHARED_CHANNEL_LENGTHS[:-1], initial=_SHARED_HEADER.size)
+)
+_SHARED_STATE_BYTES = _SHARED_CHANNEL_OFFSETS[-1] + _SHARED_CHANNEL_LENGTHS[-1]
+
+# Seconds between looks at the shared-state file while waiting for a write.
+_SHARED_POLL_INTERVAL = 0.0005
+
 
 # ---------- Configuration ----------
 
+@dataclass(frozen=True)
+class SamplingRates:
+    """How often the plugin samples each state channel, in emulated frames.
+
+    A channel with rate N is read at most once every N frames, so a change to
+    it can reach Python up to N - 1 frames late; 1 reads it on every frame.
+    ON_FLOOR_CHANGE reads it only when the player reaches a new floor (and
+    after a boot, reset, or load), for the channels the game rewrites only
+    then.
+    """
+    ON_FLOOR_CHANGE = 0
+
+    frame: int = 1
+    text: int = 1
+    maze: int = 1
+    creatures: int = 1
+    objects: int = 1
+    holes_ladders: int = 1
+
+    def __post_init__(self) -> None:
+        for field in fields(self):
+            if getattr(self, field.name) < 0:
+                raise ValueError(f"{field.name} sampling rate must not be negative")
+
+    @classmethod
+    def reduced(cls) -> "SamplingRates":
+        """Reduced rates for throughput-bound runs.
+
+        Frame and text every frame, creatures every 2 frames, objects every
+        10, and the maze and holes/ladders on floor changes.
+        """
+        return cls(
+            creatures=2,
+            objects=10,
+            maze=cls.ON_FLOOR_CHANGE,
+            holes_ladders=cls.ON_FLOOR_CHANGE,
+        )
+
+
 @dataclass(frozen=True)
 class IpcConfig:
-    """Parameters for the hybrid IPC channels between Python and MAME."""
+    """Parameters for the hybrid IPC channels between Python and MAME.
+
+    lockstep pauses the emulation between steps, so game time only passes
+    while a command runs, however long the caller takes to choose the next.
+    frames_per_step, when nonzero, makes every step run exactly that many
+    emulated frames after its command is dispatched and report one coalesced
+    set of changes at its end. settle instead ends every step once its
+    command has run and the game is prompting for the next; the two are
+    exclusive.
+
+    shared_state_path, when set, names a file the plugin keeps every
+    channel's latest value in, in place of sending changes on the FIFO.
+    recv() then returns the newest state once the file changes, skipping any
+    frames in between; leave it unset to see every change.
+
+    pipe_capacity, when set, resizes the state FIFO's kernel buffer in bytes
+    (Linux only; the kernel rounds it up to a power-of-two number of pages,
+    and caps it at /proc/sys/fs/pipe-max-size for unprivileged users). A
+    roomier pipe lets the reader fall further behind before the plugin's
+    writes block the emulator.
+
+    sampling_rates trades each channel's freshness for emulator throughput;
+    the default reads every channel on every frame.
+    """
     state_fifo_path: str = "/tmp/daggorath-state"
     command_host: str = "127.0.0.1"
     command_port: int = 15001
     connection_timeout: float = 30
+    lockstep: bool = False
+    frames_per_step: int = 0
+    settle: bool = False
+    shared_state_path: Optional[str] = None
+    pipe_capacity: Optional[int] = None
+    sampling_rates: SamplingRates = SamplingRates()
+
+    def __post_init__(self) -> None:
+        if self.settle and self.frames_per_step:
+            raise ValueError("frames_per_step and settle are exclusive")
+
+    @property
+    def marks_steps(self) -> bool:
+        """Whether the plugin marks the end of each step on the state channel."""
+        return self.lockstep or self.frames_per_step > 0 or self.settle
 
 
 @dataclass(frozen=True)
 class MameConfig:
-    """Parameters for the MAME subprocess."""
+    """Parameters for the MAME subprocess.
+
+    video, speed, and frameskip are passed to MAME only when set; throttle
+    False runs the emulation as fast as the host allows.
+    """
     plugin_name: str = "daggorath"
     sound: str = "sdl"
     window: bool = True
+    video: Optional[str] = None
+    throttle: bool = True
+    speed: Optional[float] = None
+    frameskip: Optional[int] = None
+
+    @classmethod
+    def training(cls) -> "MameConfig":
+        """Headless and unthrottled: no video, no sound, no real-time pacing.
+
+        Adjust it with dataclasses.replace(), e.g. to add a frameskip.
+        """
+        return cls(sound="none", window=False, video="none", throttle=False)
+
+
+@dataclass(frozen=True)
+class Reconstruction:
+    """The last-known channel values MameOperator rebuilds partial envelopes from."""
+    frame: Optional[bytes]
+    command_text: str
+    maze: Optional[bytes]
+    creatures: Optional[bytes]
+    objects: Optional[bytes]
+    holes_ladders: Optional[bytes]
+
+
+@dataclass(frozen=True)
+class BackpressureStats:
+    """How full the reader let the state FIFO get, sampled before each read.
+
+    queued_bytes is the latest sample and high_water_bytes the largest since
+    start(). stall_events counts the times the pipe was found with less room
+    than the largest envelope, when the plugin's next write could block the
+    emulator until the reader caught up; a rising count means the learner,
+    not the emulator, sets the pace.
+    """
+    queued_bytes: int
+    high_water_bytes: int
+    stall_events: int
+    capacity_bytes: int
+
+
+class _Message(NamedTuple):
+    """One envelope off the state channel; the payload is a view into the receive buffer."""
+    events: int
+    frame: int
+    epoch: int
+    channels: int
+    payload: memoryview
 
 
 # ---------- MameOperator ----------
@@ -90,20 +388,57 @@ class MameOperator:
 
         # ---------- state channel (FIFO) ----------
         self._state_fd: Optional[int] = None
+        self._pipe_capacity = _DEFAULT_PIPE_CAPACITY
+
+        # ---------- backpressure ----------
+        self._backlog_sample = array.array("i", [0])
+        self._queued_bytes = 0
+        self._high_water_bytes = 0
+        self._stall_events = 0
+        self._pipe_stalled = False
 
         # ---------- command channel (TCP) ----------
         self._command_socket: Optional[socket.socket] = None
         self._command_connection: Optional[socket.socket] = None
 
         # ---------- receive buffer + reconstruction ----------
-        self._receive_buffer = b""
+        # Unread bytes live in _receive_buffer[_receive_start:_receive_end].
+        self._receive_buffer = bytearray(_RECEIVE_BUFFER_BYTES)
+        self._receive_view = memoryview(self._receive_buffer)
+        self._receive_start = 0
+        self._receive_end = 0
         self._last_frame: Optional[bytes] = None
-        self._last_command_text = ""
+        self._last_command_pixels: Optional[bytes] = None
+        self._last_com_color = 0
+        self._last_command_text: Optional[str] = ""
         self._last_maze: Optional[bytes] = None
         self._last_creatures: Optional[bytes] = None
         self._last_objects: Optional[bytes] = None
         self._last_holes_ladders: Optional[bytes] = None
 
+        # ---------- shared state (optional) ----------
+        self._shared_state: Optional[mmap.mmap] = None
+        self._shared_sequence = 0
+        self._shared_generations: list[Optional[int]] = [None] * len(_SHARED_CHANNEL_LENGTHS)
+
+        # ---------- frame tracking ----------
+        # _frame_number is the newest envelope's; _state_frame the newest
+        # that carried a state channel.
+        self._epoch: Optional[int] = None
+        self._frame_number: Optional[int] = None
+        self._state_frame: Optional[int] = None
+        self._observation_lag = 0
+        self._dropped_frames = 0
+        self._discarded_bytes = 0
+
+        # ---------- emulation clock ----------
+        self._emulated_fps: Optional[float] = None
+        self._missed_notifier_frames = 0
+
+        # ---------- command settling ----------
+        self._command_matched: Optional[bool] = None
+        self._settle_timed_out = False
+
     # ---------- lifecycle ----------
 
     def start(self) -> None:
@@ -114,7 +449,13 @@ class MameOperator:
         self._remove_stale_fifo()
         os.mkfifo(fifo_path)
         self._state_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
-        print(f"[MameOperator] State FIFO ready: {fifo_path}")
+        self._pipe_capacity = self._size_state_fifo()
+        print(f"[MameOperator] State FIFO ready: {fifo_path} ({self._pipe_capacity} bytes)")
+
+        # ---------- map the shared state ----------
+        if self._ipc_config.shared_state_path is not None:
+            self._shared_state = self._create_shared_state()
+            print(f"[MameOperator] Shared state ready: {self._ipc_config.shared_state_path}")
 
         # ---------- open the command socket ----------
         self._command_socket = self._create_listening_socket(self._ipc_config.command_port)
@@ -156,6 +497,14 @@ class MameOperator:
                 pass
             self._remove_stale_fifo()
 
+        # ---------- unmap the shared state ----------
+        if self._shared_state is not None:
+            self._shared_state.close()
+            try:
+                os.unlink(self._ipc_config.shared_state_path)
+            except FileNotFoundError:
+                pass
+
         # ---------- shut down the game ----------
         if self._mame_process is not None and self._mame_process.poll() is None:
             self._mame_process.terminate()
@@ -165,137 +514,632 @@ class MameOperator:
                 self._mame_process.kill()
                 self._mame_process.wait()
 
+        # ---------- remove the snapshot files ----------
+        self._remove_snapshot_files()
+
         # ---------- clear the board ----------
         self._command_socket = None
         self._command_connection = None
         self._state_fd = None
+        self._pipe_capacity = _DEFAULT_PIPE_CAPACITY
+        self._queued_bytes = 0
+        self._high_water_bytes = 0
+        self._stall_events = 0
+        self._pipe_stalled = False
+        self._shared_state = None
+        self._shared_sequence = 0
         self._mame_process = None
-        self._receive_buffer = b""
-        self._last_frame = None
-        self._last_command_text = ""
-        self._last_maze = None
-        self._last_creatures = None
-        self._last_objects = None
-        self._last_holes_ladders = None
+        self._receive_start = 0
+        self._receive_end = 0
+        self._clear_last_state()
+        self._epoch = None
+        self._frame_number = None
+        self._observation_lag = 0
+        self._dropped_frames = 0
+        self._discarded_bytes = 0
+        self._emulated_fps = None
+        self._missed_notifier_frames = 0
+        self._command_matched = None
+        self._settle_timed_out = False
 
     # ---------- communication ----------
 
     def recv(self) -> DaggorathState:
-        """Block until the next tagged record arrives, returning current state.
+        """Block until the next envelope carrying state arrives, returning current state.
 
         The returned DaggorathState always carries the latest known numeric
-        state and the latest known command text. Records omit the unchanged
-        half, so this method reconstructs from the last-known values.
+        state and the latest known command text. Envelopes omit the unchanged
+        channels, so this method reconstructs from the last-known values.
+
+        With a shared state, it blocks until the plugin next writes the file
+        and returns the newest state it holds.
         """
+        if self._shared_state is not None:
+            return self._recv_shared()[0]
+
         while True:
             if self._state_fd is None:
                 raise ConnectionError("Operator not started or already stopped")
 
-            # ---------- parse a complete record when buffered ----------
-            record = self._extract_record()
-            if record is not None:
-                return self._parse_record(record)
+            # ---------- parse a complete envelope when buffered ----------
+            message = self._extract_message()
+            if message is not None:
+                self._apply_message(message)
+                if message.channels & _STATE_CHANNELS:
+                    return self._build_state()
+                continue
 
-            # ---------- wait for the FIFO to become readable ----------
-            readable, _, _ = select.select([self._state_fd], [], [], _STATE_READ_TIMEOUT)
-            if not readable:
-                raise TimeoutError("Timed out waiting for a state record")
+            self._read_state_fifo()
 
-            # ---------- read more bytes from the FIFO ----------
-            try:
-                chunk = os.read(self._state_fd, 4096)
-            except OSError:
-                raise ConnectionError("MAME disconnected (FIFO read error)")
-            if not chunk:
-                raise ConnectionError("MAME disconnected (EOF)")
-            self._receive_buffer += chunk
+    def recv_latest(self) -> tuple[DaggorathState, int]:
+        """Fold every queued envelope into one state for the newest frame.
+
+        Reads everything the FIFO holds without blocking, folds all of it
+        into the last-known state, and builds a single DaggorathState from
+        the result. Blocks only when no envelope carrying state is queued.
+
+        With a shared state, the file always holds the newest state, and
+        coalesced counts the plugin's writes to it since the last read.
+
+        Returns:
+            (state, coalesced) — the newest state and how many envelopes
+            carrying state it folds together.
+        """
+        if self._shared_state is not None:
+            return self._recv_shared()
+
+        coalesced = 0
+        while True:
+            if self._state_fd is None:
+                raise ConnectionError("Operator not started or already stopped")
+
+            self._drain_state_fifo()
+            while True:
+                message = self._extract_message()
+                if message is None:
+                    break
+                self._apply_message(message)
+                if message.channels & _STATE_CHANNELS:
+                    coalesced += 1
+            if coalesced:
+                return self._build_state(), coalesced
+
+            self._read_state_fifo()
 
     def send(self, command: commands.DaggorathCommand) -> None:
         """Send a command index (one byte) to MAME on the command socket."""
+        self._send_bytes(command.index)
+
+    def advance(self) -> None:
+        """Run a step with no command typed.
+
+        When steps are marked this begins one, resuming the machine if
+        lockstep paused it; otherwise the machine runs on its own and
+        nothing is sent.
+        """
+        if self._ipc_config.marks_steps:
+            self._send_bytes(_CONTROL_ADVANCE)
+
+    def recv_step(self) -> DaggorathState:
+        """Block until the current step ends, returning the state it ended on.
+
+        When steps are marked, every envelope up to and including the one
+        carrying the plugin's step-end event is folded into the returned state. Otherwise there is no step
+        boundary, and this is recv().
+        """
+        if not self._ipc_config.marks_steps:
+            return self.recv()
+        self._await_event(_EVENT_STEP_ENDED)
+        if self._shared_state is not None:
+            self._read_shared_state()
+        return self._build_state()
+
+    @property
+    def emulated_fps(self) -> Optional[float]:
+        """Emulated frames per host second over the latest clock interval."""
+        return self._emulated_fps
+
+    @property
+    def missed_notifier_frames(self) -> int:
+        """Emulated frames a Lua frame notifier did not see, since start().
+
+        Zero as long as state.lua and commands.lua run on every frame; a
+        frameskip or speed setting that starves them shows up here.
+        """
+        return self._missed_notifier_frames
+
+    @property
+    def observation_lag(self) -> int:
+        """Emulated frames the last returned state trails the newest envelope read.
+
+        Counts the envelopes already read off the FIFO behind the one the
+        state came from; 0 when the state was the newest the operator had.
+        Always 0 with a shared state, which carries no frame number.
+        """
+        return self._observation_lag
+
+    @property
+    def dropped_frames(self) -> int:
+        """Frames missing between consecutive envelopes of one epoch, since start()."""
+        return self._dropped_frames
+
+    @property
+    def discarded_bytes(self) -> int:
+        """State-channel bytes skipped to resync on the next envelope, since start()."""
+        return self._discarded_bytes
+
+    @property
+    def backpressure(self) -> BackpressureStats:
+        """How full the state FIFO has been when the reader came for it."""
+        return BackpressureStats(
+            queued_bytes=self._queued_bytes,
+            high_water_bytes=self._high_water_bytes,
+            stall_events=self._stall_events,
+            capacity_bytes=self._pipe_capacity,
+        )
+
+    @property
+    def command_matched(self) -> Optional[bool]:
+        """Whether the game's parser matched the last settled command.
+
+        Settle mode only: False for a rejected command or an advance, None
+        before the first settled step.
+        """
+        return self._command_matched
+
+    @property
+    def settle_timed_out(self) -> bool:
+        """Whether the last settle-mode step ended on the plugin's frame cap."""
+        return self._settle_timed_out
+
+    def save_snapshot(self, slot: int) -> Reconstruction:
+        """Save the running machine to a numbered snapshot slot.
+
+        Blocks until the plugin acknowledges the save. Envelopes that arrive
+        meanwhile are folded into the last-known state, which is returned as
+        it stood at the save — the Python half of the snapshot.
+        """
+        self._send_bytes(_CONTROL_SAVE_SNAPSHOT, slot)
+        self._await_event(_EVENT_SNAPSHOT_SAVED)
+        return Reconstruction(
+            frame=self._last_frame,
+            command_text=self._command_text(),
+            maze=self._last_maze,
+            creatures=self._last_creatures,
+            objects=self._last_objects,
+            holes_ladders=self._last_holes_ladders,
+        )
+
+    def load_snapshot(self, slot: int, reconstruction: Optional[Reconstruction] = None) -> None:
+        """Restore the machine from a numbered snapshot slot.
+
+        Blocks until the plugin acknowledges the load, then replaces the
+        last-known state with the one save_snapshot() returned for the slot,
+        or forgets it when none is given. The plugin re-sends every channel
+        after a load either way, so the next recv() reflects the restored
+        machine only.
+        """
+        self._send_bytes(_CONTROL_LOAD_SNAPSHOT, slot)
+        self._await_event(_EVENT_SNAPSHOT_LOADED)
+        self._clear_last_state()
+        if reconstruction is not None:
+            self._last_frame = reconstruction.frame
+            self._last_command_pixels = None
+            self._last_command_text = reconstruction.command_text
+            self._last_maze = reconstruction.maze
+            self._last_creatures = reconstruction.creatures
+            self._last_objects = reconstruction.objects
+            self._last_holes_ladders = reconstruction.holes_ladders
+
+    def restart_episode(self) -> None:
+        """Soft-reset the machine so the game boots again, keeping every channel open.
+
+        Blocks until the plugin reports the reset, then forgets the
+        last-known state. The game re-enters live play on its own; the next
+        recv() blocks until it does.
+        """
+        self._send_bytes(_CONTROL_RESTART_GAME)
+        self._await_event(_EVENT_MACHINE_RESET)
+        self._clear_last_state()
+
+    # ---------- internals ----------
+
+    def _send_bytes(self, *values: int) -> None:
+        """Send a command index, or a control opcode and its argument, to MAME."""
 
         if self._command_connection is None:
             raise ConnectionError("Operator not started or already stopped")
 
-        payload = bytes([command.index])
+        payload = bytes(values)
         try:
             self._command_connection.sendall(payload)
         except OSError as exc:
             raise ConnectionError(f"Failed to send command: {exc}")
 
-    # ---------- internals ----------
+    def _read_state_fifo(self) -> None:
+        """Block until the FIFO is readable, then read what it holds into the buffer."""
+
+        # ---------- wait for the FIFO to become readable ----------
+        readable, _, _ = select.select([self._state_fd], [], [], _STATE_READ_TIMEOUT)
+        if not readable:
+            raise TimeoutError("Timed out waiting for a state envelope")
+
+        # ---------- read straight into the free tail of the buffer ----------
+        self._sample_backlog()
+        self._reserve_receive_space()
+        try:
+            count = os.readv(self._state_fd, [self._receive_view[self._receive_end:]])
+        except OSError:
+            raise ConnectionError("MAME disconnected (FIFO read error)")
+        if not count:
+            raise ConnectionError("MAME disconnected (EOF)")
+        self._receive_end += count
+
+    def _drain_state_fifo(self) -> None:
+        """Read everything the FIFO holds into the buffer, without blocking."""
+        self._sample_backlog()
+        while True:
+            self._reserve_receive_space()
+            free = len(self._receive_buffer) - self._receive_end
+            try:
+                count = os.readv(self._state_fd, [self._receive_view[self._receive_end:]])
+            except BlockingIOError:
+                return
+            except OSError:
+                raise ConnectionError("MAME disconnected (FIFO read error)")
+            if not count:
+                raise ConnectionError("MAME disconnected (EOF)")
+            self._receive_end += count
+            if count < free:
+                return
+
+    def _sample_backlog(self) -> None:
+        """Note how many bytes the FIFO holds, before reading them.
 
-    def _extract_record(self) -> Optional[bytes]:
-        """Return a complete record if one is buffered, else None.
+        A stall event begins when the pipe has less room than the largest
+        envelope, and ends once a sample finds room again.
+        """
+        fcntl.ioctl(self._state_fd, termios.FIONREAD, self._backlog_sample)
+        queued = self._backlog_sample[0]
+        self._queued_bytes = queued
+        self._high_water_bytes = max(self._high_water_bytes, queued)
+
+        stalled = queued > self._pipe_capacity - _MESSAGE_MAX_BYTES
+        if stalled and not self._pipe_stalled:
+            self._stall_events += 1
+        self._pipe_stalled = stalled
+
+    def _reserve_receive_space(self) -> None:
+        """Make room for at least one read chunk behind the unread bytes.
+
+        Moves the unread bytes to the front of the buffer when the free tail
+        runs short — they are at most a few partial envelopes — and grows the
+        buffer only if they would not leave a chunk free.
+        """
+        capacity = len(self._receive_buffer)
+        if capacity - self._receive_end >= _READ_CHUNK_BYTES:
+            return
+
+        unread = self._receive_end - self._receive_start
+        if unread + _READ_CHUNK_BYTES > capacity:
+            buffer = bytearray(max(2 * capacity, unread + _READ_CHUNK_BYTES))
+            buffer[:unread] = self._receive_view[self._receive_start:self._receive_end]
+            self._receive_buffer = buffer
+            self._receive_view = memoryview(buffer)
+        else:
+            self._receive_view[:unread] = self._receive_view[self._receive_start:self._receive_end]
+        self._receive_start = 0
+        self._receive_end = unread
+
+    def _await_event(self, event: int) -> None:
+        """Block until an envelope carrying the given event arrives.
+
+        Envelopes ahead of it, and its own channels, are folded into the
+        last-known state, so nothing the plugin reported up to the event is
+        lost.
+        """
+        while True:
+            if self._state_fd is None:
+                raise ConnectionError("Operator not started or already stopped")
+
+            message = self._extract_message()
+            if message is None:
+                self._read_state_fifo()
+                continue
+
+            self._apply_message(message)
+            if message.events & event:
+                return
+
+    def _recv_shared(self) -> tuple[DaggorathState, int]:
+        """Block until the plugin writes the shared state, returning the newest state.
 
-        The first byte of the buffer is the record tag; its length is fixed
-        per tag. Consumes the record from the buffer on success.
+        Drains the FIFO while waiting, applying the reports its envelopes
+        carry, so the plugin never blocks on a full pipe.
         """
-        if not self._receive_buffer:
-            return None
+        deadline = time.monotonic() + _STATE_READ_TIMEOUT
+        while True:
+            if self._state_fd is None:
+                raise ConnectionError("Operator not started or already stopped")
 
-        tag = self._receive_buffer[0:1]
-        length = _RECORD_LENGTHS.get(tag)
-        if length is None:
-            # Unknown tag — drop the byte and keep going.
-            self._receive_buffer = self._receive_buffer[1:]
-            return None
+            self._drain_state_fifo()
+            while True:
+                message = self._extract_message()
+                if message is None:
+                    break
+                self._apply_message(message)
+
+            writes = self._read_shared_state()
+            if writes:
+                return self._build_state(), writes
+
+            if time.monotonic() > deadline:
+                raise TimeoutError("Timed out waiting for a shared state write")
+            time.sleep(_SHARED_POLL_INTERVAL)
+
+    def _read_shared_state(self) -> int:
+        """Fold the shared-state file into the last-known state.
+
+        Copies out only the channels whose generation moved since the last
+        read, and copies again whenever the sequence number shows the plugin
+        wrote meanwhile. Returns how many writes the read folds together: 0
+        when the file has not changed, or has not been written since the
+        latest reset or load.
+        """
+        shared = self._shared_state
+        deadline = time.monotonic() + _STATE_READ_TIMEOUT
+        while True:
+            sequence = _SHARED_SEQUENCE.unpack_from(shared)[0]
+            if sequence == self._shared_sequence:
+                return 0
+
+            if not sequence & 1:
+                _, epoch, data_epoch, *generations = _SHARED_HEADER.unpack_from(shared)
+                if data_epoch != epoch:
+                    return 0
+                changes = [
+                    (channel, shared[offset:offset + length])
+                    for index, (channel, offset, length, generation) in enumerate(zip(
+                        _SHARED_CHANNELS, _SHARED_CHANNEL_OFFSETS, _SHARED_CHANNEL_LENGTHS, generations
+                    ))
+                    if generation != self._shared_generations[index]
+                ]
+                if _SHARED_SEQUENCE.unpack_from(shared)[0] == sequence:
+                    break
+
+            if time.monotonic() > deadline:
+                raise TimeoutError("Timed out waiting for a consistent shared state")
+
+        writes = ((sequence - self._shared_sequence) & 0xFFFFFFFF) // 2
+        self._shared_sequence = sequence
+        self._shared_generations = generations
+        for channel, payload in changes:
+            self._apply_channel(channel, payload)
+        return writes
+
+    def _clear_last_state(self) -> None:
+        """Forget the last-known state used to reconstruct partial envelopes."""
+        self._last_frame = None
+        self._last_command_pixels = None
+        self._last_com_color = 0
+        self._last_command_text = ""
+        self._last_maze = None
+        self._last_creatures = None
+        self._last_objects = None
+        self._last_holes_ladders = None
+        self._state_frame = None
+        self._shared_generations = [None] * len(_SHARED_CHANNEL_LENGTHS)
 
-        if len(self._receive_buffer) < length:
-            return None
+    def _apply_clock(self, payload: bytes) -> None:
+        """Update the emulation rate and missed-frame count from a clock report."""
+        screen_frames, state_calls, command_calls, microseconds = (
+            _CLOCK_FORMAT.unpack_from(payload)
+        )
+        if microseconds:
+            self._emulated_fps = screen_frames * 1_000_000 / microseconds
+        self._missed_notifier_frames += (
+            max(0, screen_frames - state_calls) + max(0, screen_frames - command_calls)
+        )
 
-        record = self._receive_buffer[:length]
-        self._receive_buffer = self._receive_buffer[length:]
-        return record
+    def _apply_settled(self, payload: bytes) -> None:
+        """Record how the command that ended the step settled."""
+        flags = payload[0]
+        self._command_matched = bool(flags & _SETTLED_MATCHED)
+        self._settle_timed_out = bool(flags & _SETTLED_CAPPED)
 
-    def _parse_record(self, record: bytes) -> DaggorathState:
-        """Parse a tagged record into a DaggorathState carrying current state.
+    def _extract_message(self) -> Optional[_Message]:
+        """Return a complete envelope if one is buffered, else None.
 
-        Each record carries only the channel(s) that changed; the rest are
-        reconstructed from the last-known values.
+        Consumes the envelope from the buffer on success. Its payload is a
+        view into the buffer, valid only until the next read from the FIFO.
+        Bytes that cannot start an envelope, and envelopes that fail their
+        checksum, are skipped up to the next magic.
+        """
+        buffer = self._receive_buffer
+        while True:
+            start = self._receive_start
+            available = self._receive_end - start
+            if available < _MESSAGE_HEADER.size:
+                if available and not _MESSAGE_MAGIC.startswith(buffer[start:start + 2]):
+                    self._resync()
+                    continue
+                return None
+
+            magic, version, events, frame, epoch, channels, length, checksum = (
+                _MESSAGE_HEADER.unpack_from(buffer, start)
+            )
+            bounds = (
+                _PAYLOAD_LENGTH_BOUNDS[channels]
+                if channels < len(_PAYLOAD_LENGTH_BOUNDS) else None
+            )
+            if (
+                magic != _MESSAGE_MAGIC
+                or version != _MESSAGE_VERSION
+                or bounds is None
+                or not bounds[0] <= length <= bounds[1]
+            ):
+                self._resync()
+                continue
+
+            payload_start = start + _MESSAGE_HEADER.size
+            end = payload_start + length
+            if end > self._receive_end:
+                return None
+
+            view = self._receive_view
+            if checksum != (
+                sum(view[start:start + _CHECKSUMMED_HEADER_BYTES]) + sum(view[payload_start:end])
+            ) & 0xFFFF:
+                self._resync()
+                continue
+
+            if end == self._receive_end:
+                # Drained: the next read starts at the front again.
+                self._receive_start = self._receive_end = 0
+            else:
+                self._receive_start = end
+            return _Message(events, frame, epoch, channels, view[payload_start:end])
+
+    def _resync(self) -> None:
+        """Skip the unread byte that cannot start an envelope, and all up to the next magic."""
+        start = self._receive_start
+        found = self._receive_buffer.find(_MESSAGE_MAGIC, start + 1, self._receive_end)
+        if found == -1:
+            # Keep a trailing first magic byte: the second may not be here yet.
+            found = self._receive_end
+            if found - 1 > start and self._receive_buffer[found - 1] == _MESSAGE_MAGIC[0]:
+                found -= 1
+        self._discarded_bytes += found - start
+        if found == self._receive_end:
+            self._receive_start = self._receive_end = 0
+        else:
+            self._receive_start = found
+
+    def _apply_message(self, message: _Message) -> None:
+        """Fold an envelope's channels into the last-known state, tracking its frame.
+
+        A new epoch means the machine was reset or loaded: the last-known
+        state is forgotten, and the plugin re-sends every channel. Within an
+        epoch, a gap in the frame numbers counts as dropped frames.
+        """
+        if message.epoch != self._epoch:
+            self._epoch = message.epoch
+            self._clear_last_state()
+        elif message.frame > self._frame_number + 1:
+            self._dropped_frames += message.frame - self._frame_number - 1
+        self._frame_number = message.frame
+
+        channels = message.channels
+        if not channels:
+            return
+        if channels & _STATE_CHANNELS:
+            self._state_frame = message.frame
+
+        payload = message.payload
+        offset = 0
+        for channel, length in _CHANNEL_LENGTHS.items():
+            if channels & channel:
+                self._apply_channel(channel, payload[offset:offset + length])
+                offset += length
+        for channel, (_, entry_bytes) in _DELTA_CHANNELS.items():
+            if channels & channel:
+                end = offset + 1 + payload[offset] * entry_bytes
+                self._apply_delta(channel, payload[offset + 1:end])
+                offset = end
+
+    def _apply_channel(self, channel: int, payload: bytes) -> None:
+        """Apply one channel's payload, from an envelope or the shared state.
+
+        An envelope's payload is a view into the receive buffer, which is
+        reused, so each state channel is copied out once. Command-area pixels
+        are kept undecoded until a state is built from them, so envelopes
+        folded over never pay for text.
+        """
+        if channel == _CHANNEL_FRAME:
+            self._last_frame = bytes(payload)
+        elif channel == _CHANNEL_TEXT:
+            self._last_com_color = payload[0]
+            self._last_command_pixels = bytes(payload[1:])
+            self._last_command_text = None
+        elif channel == _CHANNEL_MAZE:
+            self._last_maze = bytes(payload)
+        elif channel == _CHANNEL_CREATURES:
+            self._last_creatures = bytes(payload)
+        elif channel == _CHANNEL_OBJECTS:
+            self._last_objects = bytes(payload)
+        elif channel == _CHANNEL_HOLES_LADDERS:
+            self._last_holes_ladders = bytes(payload)
+        elif channel == _CHANNEL_CLOCK:
+            self._apply_clock(payload)
+        else:
+            self._apply_settled(payload)
+
+    def _apply_delta(self, channel: int, entries: memoryview) -> None:
+        """Patch the last-known creatures or maze with a delta channel's entries.
+
+        States already built share the last-known bytes, so the patch goes
+        into a copy. A delta with no copy to patch (its full channel was lost
+        to a resync) is dropped; the plugin re-sends the full channel soon.
         """
-        tag = record[0:1]
-
-        frame = self._last_frame
-        command_text = self._last_command_text
-        maze = self._last_maze
-        creatures = self._last_creatures
-        objects = self._last_objects
-        holes_ladders = self._last_holes_ladders
-
-        if tag in (b"S", b"B"):
-            frame = record[1:1 + FRAME_LEN]
-
-        if tag in (b"T", b"B"):
-            offset = 1 + (FRAME_LEN if tag == b"B" else 0)
-            com_color = record[offset]
-            pixels = record[offset + 1:offset + 1 + PIXEL_BYTES]
-            command_text = decode_command_area(pixels, com_color)
-
-        if tag == b"M":
-            maze = record[1:1 + MAZE_BYTES]
-        elif tag == b"C":
-            creatures = record[1:1 + CREATURE_BYTES]
-        elif tag == b"O":
-            objects = record[1:1 + OBJECTS_BYTES]
-        elif tag == b"H":
-            holes_ladders = record[1:1 + HOLES_LADDERS_BYTES]
-
-        if frame is None:
-            raise ConnectionError("Received a record before any numeric state")
-
-        self._last_frame = frame
-        self._last_command_text = command_text
-        self._last_maze = maze
-        self._last_creatures = creatures
-        self._last_objects = objects
-        self._last_holes_ladders = holes_ladders
+        if channel == _CHANNEL_CREATURE_DELTA:
+            if self._last_creatures is None:
+                return
+            creatures = bytearray(self._last_creatures)
+            for start in range(0, len(entries), _CREATURE_DELTA_ENTRY_BYTES):
+                offset = entries[start] * CREATURE_FIELDS
+                creatures[offset:offset + CREATURE_FIELDS] = (
+                    entries[start + 1:start + _CREATURE_DELTA_ENTRY_BYTES]
+                )
+            self._last_creatures = bytes(creatures)
+        else:
+            if self._last_maze is None:
+                return
+            maze = bytearray(self._last_maze)
+            for index, value in _MAZE_DELTA_ENTRY.iter_unpack(entries):
+                maze[index] = value
+            self._last_maze = bytes(maze)
+
+    def _newest_buffered_frame(self) -> int:
+        """The frame number of the newest envelope read off the FIFO.
+
+        Walks the headers still buffered without consuming them, stopping at
+        one that is malformed or from a later epoch.
+        """
+        newest = self._frame_number
+        position = self._receive_start
+        while position + _MESSAGE_HEADER.size <= self._receive_end:
+            magic, _, _, frame, epoch, _, length, _ = (
+                _MESSAGE_HEADER.unpack_from(self._receive_buffer, position)
+            )
+            if magic != _MESSAGE_MAGIC or epoch != self._epoch:
+                break
+            newest = frame
+            position += _MESSAGE_HEADER.size + length
+        return newest
+
+    def _command_text(self) -> str:
+        """The last-known command text, decoded from its pixels on first use."""
+        if self._last_command_text is None:
+            self._last_command_text = decode_command_area(
+                self._last_command_pixels, self._last_com_color
+            )
+        return self._last_command_text
+
+    def _build_state(self) -> DaggorathState:
+        """Build a DaggorathState from the last-known channel values, noting its lag."""
+        if self._last_frame is None:
+            raise ConnectionError("Received an envelope before any numeric state")
+
+        if self._state_frame is not None:
+            self._observation_lag = self._newest_buffered_frame() - self._state_frame
+
         return DaggorathState(
-            frame,
-            command_text=command_text,
-            maze=maze,
-            creatures=creatures,
-            objects=objects,
-            holes_ladders=holes_ladders,
+            self._last_frame,
+            command_text=self._command_text(),
+            maze=self._last_maze,
+            creatures=self._last_creatures,
+            objects=self._last_objects,
+            holes_ladders=self._last_holes_ladders,
         )
 
     def _remove_stale_fifo(self) -> None:
@@ -304,6 +1148,45 @@ class MameOperator:
         if os.path.exists(fifo_path):
             os.unlink(fifo_path)
 
+    def _size_state_fifo(self) -> int:
+        """Apply IpcConfig.pipe_capacity to the state FIFO, returning its capacity in bytes."""
+        capacity = self._ipc_config.pipe_capacity
+        if capacity is not None:
+            if not hasattr(fcntl, "F_SETPIPE_SZ"):
+                print("[MameOperator] Pipe capacity is fixed on this platform; ignoring pipe_capacity")
+            else:
+                try:
+                    fcntl.fcntl(self._state_fd, fcntl.F_SETPIPE_SZ, capacity)
+                except OSError as exc:
+                    raise ValueError(
+                        f"Cannot size the state FIFO to {capacity} bytes: {exc}"
+                    ) from exc
+
+        if hasattr(fcntl, "F_GETPIPE_SZ"):
+            return fcntl.fcntl(self._state_fd, fcntl.F_GETPIPE_SZ)
+        return _DEFAULT_PIPE_CAPACITY
+
+    def _create_shared_state(self) -> mmap.mmap:
+        """Create the zero-filled shared-state file and map it for reading."""
+        path = self._ipc_config.shared_state_path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, _SHARED_STATE_BYTES)
+            return mmap.mmap(fd, _SHARED_STATE_BYTES, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+    def _remove_snapshot_files(self) -> None:
+        """Remove the snapshot files left by this operator's MAME process.
+
+        The plugin names slot N's file after the state FIFO: <fifo>-N.sta.
+        """
+        fifo_path = self._ipc_config.state_fifo_path
+        for snapshot_path in glob.glob(glob.escape(fifo_path) + "-*.sta"):
+            slot = snapshot_path[len(fifo_path) + 1:-len(".sta")]
+            if slot.isdigit():
+                os.unlink(snapshot_path)
+
     def _create_listening_socket(self, port: int) -> socket.socket:
         """Create a TCP socket, bind it, and begin listening."""
         host = self._ipc_config.command_host
@@ -337,11 +1220,27 @@ class MameOperator:
         ]
         if config.window:
             command_line.append("-window")
+        if config.video is not None:
+            command_line += ["-video", config.video]
+        if not config.throttle:
+            command_line.append("-nothrottle")
+        if config.speed is not None:
+            command_line += ["-speed", str(config.speed)]
+        if config.frameskip is not None:
+            command_line += ["-frameskip", str(config.frameskip)]
 
         # ---------- fire it up ----------
         env = os.environ.copy()
         env["STATE_FIFO_PATH"] = self._ipc_config.state_fifo_path
         env["COMMAND_HOST"] = self._ipc_config.command_host
         env["COMMAND_PORT"] = str(self._ipc_config.command_port)
+        env["SNAPSHOT_PATH_PREFIX"] = self._ipc_config.state_fifo_path
+        env["LOCKSTEP"] = "1" if self._ipc_config.lockstep else "0"
+        env["FRAMES_PER_STEP"] = str(self._ipc_config.frames_per_step)
+        env["SETTLE"] = "1" if self._ipc_config.settle else "0"
+        env["SHARED_STATE_PATH"] = self._ipc_config.shared_state_path or ""
+        for field in fields(SamplingRates):
+            rate = getattr(self._ipc_config.sampling_rates, field.name)
+            env[f"SAMPLING_RATE_{field.name.upper()}"] = str(rate)
         print(f"[MameOperator] Launching: {' '.join(command_line)}")
         return subprocess.Popen(command_line, env=env)
\ No newline at end of file
@@ -1,10 +1,14 @@
 """Gymnasium environment for Dungeons of Daggorath (1982) on MAME."""
 
+import itertools
+from dataclasses import dataclass
+
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
 
-from .emulator import MameOperator, IpcConfig
+from .emulator import SNAPSHOT_SLOTS, MameOperator, IpcConfig, Reconstruction
+from .pool import MameOperatorPool
 from .commands import (
     NUM_OBJECT_SPECIFIERS,
     NUM_TEMPLATES,
@@ -13,6 +17,34 @@ from .commands import (
 )
 from .state import PERCEIVED_SPACE, DaggorathState
 
+# How reset() starts an episode: "relaunch" boots a fresh MAME process;
+# "snapshot" restores a post-boot machine snapshot in the running process;
+# "restart" soft-resets the running process so the game boots again.
+_RESET_MODES = ("relaunch", "snapshot", "restart")
+
+# How a free-running step() reads state: "next" takes the next queued record;
+# "latest" folds everything queued into the newest state.
+_RECEIVE_MODES = ("next", "latest")
+
+# Snapshot slot 0 holds the episode start for "snapshot" reset mode; the
+# rest hold checkpoints, reused round-robin.
+_EPISODE_SNAPSHOT_SLOT = 0
+_CHECKPOINT_SLOTS = range(1, SNAPSHOT_SLOTS)
+
+
+@dataclass(frozen=True)
+class Checkpoint:
+    """A branch point returned by DaggorathEnv.snapshot().
+
+    The machine half lives in a snapshot slot of the running MAME process;
+    the Python half is carried here. A checkpoint goes stale when its slot is
+    reused or its emulator is replaced.
+    """
+    slot: int
+    generation: int
+    reconstruction: Reconstruction
+    current_state: DaggorathState
+
 
 class DaggorathEnv(gym.Env):
     """A Gymnasium environment that wraps Dungeons of Daggorath via MAME.
@@ -20,15 +52,56 @@ class DaggorathEnv(gym.Env):
     Action space: MultiDiscrete([26, 31]) — a (template, object) pair.
     Observation space: Dict — the perceived state (scalars + world channels).
     Lifecycle: owns a MameOperator; creates it on reset(), stops on close().
+    In "relaunch" reset mode every reset() stops it and boots a new one; in
+    "snapshot" mode the first reset() boots it and saves a snapshot of the
+    first live frame, and every reset() restores that snapshot; in "restart"
+    mode the first reset() boots it and later ones soft-reset the machine.
+    With a pool_size, relaunch resets take an operator from a warm pool of
+    pre-booted instances instead, and hand the retired one back to it.
+    In "latest" receive mode each step() drains every queued record into the
+    newest state and reports how many it folded as info["records_coalesced"].
+    With a lockstep IpcConfig, MAME pauses after each step and resumes on the
+    next; with frames_per_step, each step runs a fixed number of frames;
+    with settle, each step lasts until its command has run. In all three,
+    each step() returns the state the step ended on.
+    Checkpoints: snapshot() saves the machine and the Python-side state into
+    a Checkpoint, and restore() returns the episode to it, any number of
+    times, until the next reset() replaces the emulator or 255 later
+    snapshots reuse its slot.
     Status: reward is a placeholder 0.0 (the reward wrapper computes the real
     value); termination/truncation still raise NotImplementedError.
     """
 
-    def __init__(self, mame_config=None, ipc_config=None):
+    def __init__(
+        self,
+        mame_config=None,
+        ipc_config=None,
+        reset_mode="relaunch",
+        pool_size=0,
+        receive_mode="next",
+    ):
         super(DaggorathEnv, self).__init__()
 
+        if reset_mode not in _RESET_MODES:
+            raise ValueError(
+                f"reset_mode must be one of {_RESET_MODES}, got {reset_mode!r}"
+            )
+        if pool_size and reset_mode != "relaunch":
+            raise ValueError("A warm pool replaces relaunching; use reset_mode='relaunch'")
+        if receive_mode not in _RECEIVE_MODES:
+            raise ValueError(
+                f"receive_mode must be one of {_RECEIVE_MODES}, got {receive_mode!r}"
+            )
+        if receive_mode == "latest" and ipc_config is not None and ipc_config.marks_steps:
+            raise ValueError("Marked steps already fold their records; use receive_mode='next'")
+
         self._mame_config = mame_config
         self._ipc_config = ipc_config
+        self._marks_steps = ipc_config is not None and ipc_config.marks_steps
+        self._settle = ipc_config is not None and ipc_config.settle
+        self._receive_mode = receive_mode
+        self._reset_mode = reset_mode
+        self._pool_size = pool_size
 
         # Action space: (template, object) — the command shape plus the object
         # specifier index shared with the observation.
@@ -38,12 +111,19 @@ class DaggorathEnv(gym.Env):
         self.observation_space = PERCEIVED_SPACE
 
         self._emulator: MameOperator | None = None
+        self._pool: MameOperatorPool | None = None
 
         # The most recent true (ungated) state. The environment holds it so
         # the reward wrapper can read it through the environment object —
         # never through `info` or the observation (see reward/plan.md).
         self._current_state: DaggorathState | None = None
 
+        # Checkpoint bookkeeping: the next slot to fill, and the generation
+        # each slot currently holds in the running emulator.
+        self._checkpoint_slots = itertools.cycle(_CHECKPOINT_SLOTS)
+        self._checkpoint_generations = itertools.count()
+        self._live_checkpoints: dict[int, int] = {}
+
     # ---- Gym interface ---------------------------------------------------
 
     def reset(self, *, seed: int | None = None, options: dict | None = None):
@@ -54,22 +134,23 @@ class DaggorathEnv(gym.Env):
             options: Optional configuration dict (not yet used).
 
         Returns:
-            (observation, info) tuple. Info contains {"seed": seed}
-            when seed is provided.
+            (observation, info) tuple. Info carries the emulation clock
+            (see step()) and {"seed": seed} when seed is provided.
         """
-        if self._emulator is not None:
-            self._emulator.stop()
+        if self._pool_size:
+            state = self._acquire_emulator()
+        else:
+            if self._emulator is None or self._reset_mode == "relaunch":
+                self._start_emulator()
+            elif self._reset_mode == "snapshot":
+                self._emulator.load_snapshot(_EPISODE_SNAPSHOT_SLOT)
+            else:
+                self._emulator.restart_episode()
+            state = self._emulator.recv_step()
 
-        self._emulator = MameOperator(
-            mame_config=self._mame_config,
-            ipc_config=self._ipc_config,
-        )
-        self._emulator.start()
-
-        state = self._emulator.recv()
         self._current_state = state
 
-        info: dict = {}
+        info = self._emulator_info()
         if seed is not None:
             info["seed"] = seed
 
@@ -78,32 +159,145 @@ class DaggorathEnv(gym.Env):
     def step(self, action: np.ndarray) -> tuple[np.ndarray, float, bool, bool, dict]:
         # Map the factored action to a wire command index. A syntactically
         # invalid pair (INCANT + non-ring) yields None and is a no-op — no
-        # command is sent, and the frame still advances.
+        # command is typed, and the frame still advances.
         command_index = derive_command_index(int(action[0]), int(action[1]))
         if command_index is not None:
             self._emulator.send(DaggorathCommand(index=command_index))
+        else:
+            self._emulator.advance()
 
-        # Receive the next game state. Step/frame sync is "latest": one
-        # record per recv(), merged into the latest known state. The command's
+        # Receive the next game state. Free-running, a "next" step takes one
+        # record, merged into the latest known state, and the command's
         # effect may land a step later — harmless, because the reward wrapper
-        # computes from state transitions. "Wait-for-settle" (perfectMatch on
-        # the wire) is the follow-up.
-        state = self._emulator.recv()
+        # computes from state transitions. A "latest" step folds everything
+        # queued instead, so the observation never lags behind the game.
+        # With marked steps (lockstep, frames_per_step, settle) the state is
+        # where the step ended; in settle mode that is after the command
+        # resolved, so one step is one command.
+        records_coalesced = None
+        if self._receive_mode == "latest":
+            state, records_coalesced = self._emulator.recv_latest()
+        else:
+            state = self._emulator.recv_step()
         self._current_state = state
 
         reward = self._compute_reward(state)
         terminated = self._check_terminated(state)
         truncated = self._check_truncated(state)
 
-        return state.as_perceived(), reward, terminated, truncated, {}
+        info = self._emulator_info()
+        if records_coalesced is not None:
+            info["records_coalesced"] = records_coalesced
+        if self._settle:
+            info["command_matched"] = self._emulator.command_matched
+            info["settle_timed_out"] = self._emulator.settle_timed_out
+
+        return state.as_perceived(), reward, terminated, truncated, info
+
+    def snapshot(self) -> Checkpoint:
+        """Save the current episode as a Checkpoint that restore() returns to."""
+        if self._emulator is None:
+            raise RuntimeError("snapshot() needs a running episode; call reset() first")
+
+        slot = next(self._checkpoint_slots)
+        generation = next(self._checkpoint_generations)
+        reconstruction = self._emulator.save_snapshot(slot)
+        self._live_checkpoints[slot] = generation
+        return Checkpoint(
+            slot=slot,
+            generation=generation,
+            reconstruction=reconstruction,
+            current_state=self._current_state,
+        )
+
+    def restore(self, checkpoint: Checkpoint):
+        """Return the episode to a checkpoint taken by snapshot().
+
+        Returns:
+            (observation, info) tuple for the restored state, as reset() does.
+        """
+        if self._live_checkpoints.get(checkpoint.slot) != checkpoint.generation:
+            raise ValueError("Checkpoint is stale: its slot was reused or its emulator replaced")
+
+        self._emulator.load_snapshot(checkpoint.slot, checkpoint.reconstruction)
+        if self._marks_steps:
+            # The load began a step; let it end before the next.
+            self._emulator.recv_step()
+        self._current_state = checkpoint.current_state
+        return self._current_state.as_perceived(), {}
 
     def close(self):
         if self._emulator is not None:
             self._emulator.stop()
             self._emulator = None
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
 
     # ---- helpers ---------------------------------------------------------
 
+    def _emulator_info(self) -> dict:
+        """The emulation clock and state-channel health reported in info.
+
+        emulated_fps is emulated frames per host second (None until the first
+        clock interval); missed_notifier_frames stays 0 while the plugin's
+        frame notifiers run on every emulated frame. observation_lag is how
+        many emulated frames the observation trails the newest frame read;
+        dropped_frames and discarded_bytes stay 0 while the state channel
+        delivers every envelope intact. backpressure is a BackpressureStats
+        of how full the state FIFO has been.
+        """
+        return {
+            "emulated_fps": self._emulator.emulated_fps,
+            "missed_notifier_frames": self._emulator.missed_notifier_frames,
+            "observation_lag": self._emulator.observation_lag,
+            "dropped_frames": self._emulator.dropped_frames,
+            "discarded_bytes": self._emulator.discarded_bytes,
+            "backpressure": self._emulator.backpressure,
+        }
+
+    def _acquire_emulator(self) -> DaggorathState:
+        """Swap in a pre-booted MameOperator from the warm pool.
+
+        The pool is created on the first reset(), which waits for its first
+        boot; the retired operator goes back to the pool to be replaced.
+        Returns the new operator's first live state.
+        """
+        if self._pool is None:
+            self._pool = MameOperatorPool(
+                self._pool_size,
+                mame_config=self._mame_config,
+                ipc_config=self._ipc_config,
+            )
+        if self._emulator is not None:
+            self._pool.release(self._emulator)
+
+        self._emulator, state = self._pool.acquire()
+        self._live_checkpoints.clear()
+        return state
+
+    def _start_emulator(self) -> None:
+        """Boot a fresh MameOperator, replacing any running one.
+
+        In snapshot mode, wait for the first live frame, save it as the
+        episode snapshot, and restore it straight away — so the first episode
+        starts from exactly the state every later reset() restores.
+        """
+        if self._emulator is not None:
+            self._emulator.stop()
+
+        self._emulator = MameOperator(
+            mame_config=self._mame_config,
+            ipc_config=self._ipc_config,
+        )
+        self._emulator.start()
+        self._live_checkpoints.clear()
+
+        if self._reset_mode == "snapshot":
+            self._emulator.recv_step()
+            self._emulator.save_snapshot(_EPISODE_SNAPSHOT_SLOT)
+            self._emulator.load_snapshot(_EPISODE_SNAPSHOT_SLOT)
+
     @property
     def current_state(self) -> DaggorathState | None:
         """The most recent true (ungated) state, for the reward wrapper."""
@@ -0,0 +1,114 @@
+"""Warm pool of pre-booted MAME operators.
+
+Boots MameOperator instances on background threads and parks each one on its
+first live record, so an episode can start without waiting for MAME to boot.
+"""
+
+import collections
+import dataclasses
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from .emulator import IpcConfig, MameConfig, MameOperator
+from .state import DaggorathState
+
+
+class MameOperatorPool:
+    """Keeps `size` MameOperators booted past the readiness gate.
+
+    acquire() hands out the longest-parked operator together with the first
+    live state it received, and starts booting a replacement; release() takes
+    a retired operator back and stops it on a background thread. Each operator
+    gets its own IPC endpoints — the state FIFO path (and any shared-state
+    path) suffixed and the command port offset by an endpoint number — so the pool cycles through size + 1
+    endpoints, and a retired operator's endpoint is reused only after it has
+    stopped. A parked game keeps running; the records it writes meanwhile
+    queue on its state FIFO for the first recv() after acquire().
+    """
+
+    def __init__(
+        self,
+        size: int,
+        mame_config: Optional[MameConfig] = None,
+        ipc_config: Optional[IpcConfig] = None,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1, got {size}")
+
+        self._mame_config = mame_config
+        self._ipc_config = ipc_config or IpcConfig()
+
+        # Work runs in submission order, so a boot that waits on its
+        # endpoint's stop always finds that stop already running.
+        self._executor = ThreadPoolExecutor(max_workers=size + 1, thread_name_prefix="mame-pool")
+
+        # Parked operators in boot order, as futures of (operator, state, endpoint).
+        self._parked: collections.deque[Future] = collections.deque()
+
+        # Endpoints with no operator, each with the stop still freeing it (or None).
+        self._free_endpoints: collections.deque[tuple[int, Optional[Future]]] = (
+            collections.deque([(size, None)])
+        )
+
+        # Endpoint number of each operator handed out by acquire().
+        self._acquired_endpoints: dict[MameOperator, int] = {}
+
+        for endpoint in range(size):
+            self._parked.append(self._executor.submit(self._boot_operator, endpoint, None))
+
+    def acquire(self) -> tuple[MameOperator, DaggorathState]:
+        """Return a booted operator and its first live state.
+
+        Blocks only when no parked operator has finished booting yet.
+        """
+        operator, state, endpoint = self._parked.popleft().result()
+        self._acquired_endpoints[operator] = endpoint
+
+        endpoint, stopping = self._free_endpoints.popleft()
+        self._parked.append(self._executor.submit(self._boot_operator, endpoint, stopping))
+        return operator, state
+
+    def release(self, operator: MameOperator) -> None:
+        """Retire an acquired operator, stopping it in the background."""
+        endpoint = self._acquired_endpoints.pop(operator)
+        self._free_endpoints.append((endpoint, self._executor.submit(operator.stop)))
+
+    def close(self) -> None:
+        """Stop every parked operator and shut down the background threads.
+
+        Operators still acquired belong to their caller, which stops them.
+        """
+        while self._parked:
+            try:
+                operator, _, _ = self._parked.popleft().result()
+            except Exception:
+                continue
+            operator.stop()
+        self._executor.shutdown(wait=True)
+
+    # ---------- internals ----------
+
+    def _boot_operator(
+        self, endpoint: int, stopping: Optional[Future]
+    ) -> tuple[MameOperator, DaggorathState, int]:
+        """Start an operator on the given endpoint and wait for its first live record."""
+        if stopping is not None:
+            stopping.result()
+
+        ipc_config = dataclasses.replace(
+            self._ipc_config,
+            state_fifo_path=f"{self._ipc_config.state_fifo_path}-{endpoint}",
+            command_port=self._ipc_config.command_port + endpoint,
+        )
+        if ipc_config.shared_state_path is not None:
+            ipc_config = dataclasses.replace(
+                ipc_config, shared_state_path=f"{ipc_config.shared_state_path}-{endpoint}"
+            )
+        operator = MameOperator(mame_config=self._mame_config, ipc_config=ipc_config)
+        try:
+            operator.start()
+            state = operator.recv_step()
+        except BaseException:
+            operator.stop()
+            raise
+        return operator, state, endpoint
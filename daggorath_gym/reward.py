@@ -142,6 +142,21 @@ class DaggorathReward:
         self._visited_cells.clear()
         self._kill_counts.clear()
 
+    def save_memory(self):
+        """Return a copy of the episode-scoped memory, for restore_memory()."""
+        return frozenset(self._visited_cells), dict(self._kill_counts)
+
+    def restore_memory(self, memory):
+        """Replace the episode-scoped memory with one save_memory() returned.
+
+        Restoring an environment checkpoint rewinds what the agent has
+        learned along with the game: cells and kills after the checkpoint pay
+        again on the branch that re-reaches them.
+        """
+        visited_cells, kill_counts = memory
+        self._visited_cells = set(visited_cells)
+        self._kill_counts = dict(kill_counts)
+
     def compute(self, previous, current, terminated):
         """Return the scalar reward for a previous -> current transition.
 
@@ -278,6 +293,22 @@ class DaggorathRewardWrapper(gym.Wrapper):
         self._reward.reset()
         return observation, info
 
+    def snapshot(self):
+        """Checkpoint the environment together with the reward's episode memory.
+
+        The returned handle holds the environment's Checkpoint, the novelty
+        memory, and the previous state the next step's shaping term needs.
+        """
+        return self.env.snapshot(), self._reward.save_memory(), self._previous_state
+
+    def restore(self, checkpoint):
+        """Return the environment and the reward memory to a snapshot()."""
+        environment_checkpoint, memory, previous_state = checkpoint
+        observation, info = self.env.restore(environment_checkpoint)
+        self._reward.restore_memory(memory)
+        self._previous_state = previous_state
+        return observation, info
+
     def step(self, action):
         previous_state = self._previous_state
         observation, _, terminated, truncated, info = self.env.step(action)
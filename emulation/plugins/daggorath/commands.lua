@@ -2,8 +2,24 @@
 -- Receives 1-byte command indices from the command socket, looks up the
 -- corresponding command phrase, and dispatches it to the game's text parser.
 --
--- Public API: commands.beginProcessing(socket)
+-- Bytes at or above 0xF0 are control opcodes rather than command indices:
+-- they save or load a machine snapshot, or soft-reset the machine so the
+-- game boots again. Save and load are followed by a one-byte slot number;
+-- slot N lives at config.snapshot_path_prefix .. "-N.sta".
+--
+-- A command, the advance opcode (a step with nothing typed), a load, or a
+-- restart begins the next step, which state.lua ends and marks. In lockstep
+-- mode state.lua also pauses the machine at each step end, and beginning
+-- the next step resumes it.
+--
+-- Public API: commands.beginProcessing(socket, config)
 --   socket: emu.file "r" socket (opened by init.lua)
+--   config: { snapshot_path_prefix = path,  (absolute path prefix of the snapshot files)
+--             lockstep = boolean,           (resume the paused machine per step)
+--             begin_step = function }       (called as each step begins, with
+--                                            whether it typed a command)
+-- Public API: commands.notifierCalls()
+--   running count of unpaused frames this module's notifier saw
 
 local commands = {}
 
@@ -92,15 +108,39 @@ end
 
 local COMMAND_PHRASES = _build_command_phrases()
 
+-- Control opcodes, above the command index range.
+local CONTROL_SAVE_SNAPSHOT = 0xF0
+local CONTROL_LOAD_SNAPSHOT = 0xF1
+local CONTROL_RESTART_GAME = 0xF2
+local CONTROL_ADVANCE = 0xF3
+
 -- Internal state
 local _socket = nil
+local _snapshotPathPrefix = nil
+local _pendingControl = nil
+local _lockstep = false
+local _beginStep = nil
 local _inputPrimed = false
 local _frameCount = 0
+local _notifierCalls = 0
 local _frameSubscription = nil
 
 -- Prime the CoCo's input buffer after this many frames (well past boot).
 local PRIME_FRAME = 300
 
+-- Path of the snapshot file for a slot number.
+local function _snapshotPath(slot)
+    return string.format("%s-%d.sta", _snapshotPathPrefix, slot)
+end
+
+-- Begin the next step, resuming the machine if lockstep paused it.
+local function _beginNextStep(typed)
+    _beginStep(typed)
+    if _lockstep then
+        emu.unpause()
+    end
+end
+
 -- Per-frame notifier: acquire the keyboard, prime on the first frame, then
 -- read commands.
 local function _onFrame()
@@ -111,6 +151,9 @@ local function _onFrame()
     if not manager.machine then
         return
     end
+    if not manager.machine.paused then
+        _notifierCalls = _notifierCalls + 1
+    end
     if not manager.machine.natkeyboard then
         return
     end
@@ -135,26 +178,66 @@ local function _onFrame()
 
     local commandIndex = string.byte(raw)
 
+    -- The byte after a save or load opcode is its slot number.
+    if _pendingControl then
+        local opcode = _pendingControl
+        _pendingControl = nil
+        if opcode == CONTROL_SAVE_SNAPSHOT then
+            manager.machine:save(_snapshotPath(commandIndex))
+        else
+            manager.machine:load(_snapshotPath(commandIndex))
+            _beginNextStep(false)
+        end
+        return
+    end
+
+    -- Control opcodes act on the machine instead of typing a phrase. Each is
+    -- scheduled by MAME and completes between frames.
+    if commandIndex == CONTROL_SAVE_SNAPSHOT or commandIndex == CONTROL_LOAD_SNAPSHOT then
+        _pendingControl = commandIndex
+        return
+    end
+    if commandIndex == CONTROL_RESTART_GAME then
+        manager.machine:soft_reset()
+        _beginNextStep(false)
+        return
+    end
+    if commandIndex == CONTROL_ADVANCE then
+        _beginNextStep(false)
+        return
+    end
+
     -- Lua is 1-indexed; Python sends 0-based indices
     local luaIndex = commandIndex + 1
 
     if luaIndex < 1 or luaIndex > #COMMAND_PHRASES then
         print("[commands] Invalid command index: " .. commandIndex)
+        _beginNextStep(false)
         return
     end
 
     keyboard:post(COMMAND_PHRASES[luaIndex] .. "\r")
+    _beginNextStep(true)
 end
 
 -- Public: start processing commands.
-function commands.beginProcessing(socket)
+function commands.beginProcessing(socket, config)
     _socket = socket
+    _snapshotPathPrefix = config.snapshot_path_prefix
+    _pendingControl = nil
+    _lockstep = config.lockstep or false
+    _beginStep = config.begin_step
     _inputPrimed = false
     _frameCount = 0
 
     _frameSubscription = emu.add_machine_frame_notifier(_onFrame)
 end
 
+-- Public: the running count of unpaused frames this notifier saw.
+function commands.notifierCalls()
+    return _notifierCalls
+end
+
 -- Public: clear machine references so the next frame re-acquires them.
 function commands.onReset()
     _inputPrimed = false
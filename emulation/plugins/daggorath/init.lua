@@ -11,11 +11,17 @@ exports.version = "0.0.1"
 exports.license = "MIT"
 exports.author = { name = "Daggorath Gym" }
 
+-- State FIFO buffer: one pipe-atomic write (PIPE_BUF) holds the largest
+-- per-frame envelope, so each frame's flush is a single write(2).
+local STATE_BUFFER_BYTES = 4096
+
 local commands = require("daggorath/commands")
 local state = require("daggorath/state")
 
 local resetSubscription = nil
 local stopSubscription = nil
+local preSaveSubscription = nil
+local postLoadSubscription = nil
 
 local function _onReset()
     -- MAME rebuilds the machine on reset; clear cached machine references so
@@ -24,6 +30,15 @@ local function _onReset()
     commands.onReset()
 end
 
+local function _onPreSave()
+    state.onSave()
+end
+
+local function _onPostLoad()
+    -- The restored machine differs from every snapshot state.lua holds.
+    state.onLoad()
+end
+
 local function _onStop()
     -- Clean up when emulation stops
 end
@@ -36,6 +51,7 @@ function exports.startplugin()
         print("[daggorath] ERROR: Could not open state FIFO: " .. stateFifoPath)
         return
     end
+    stateFile:setvbuf("full", STATE_BUFFER_BYTES)
     print("[daggorath] State FIFO opened: " .. stateFifoPath)
 
     -- Open the command socket for reading
@@ -49,13 +65,56 @@ function exports.startplugin()
     end
     print("[daggorath] Command socket opened: " .. commandHost .. ":" .. commandPort)
 
+    -- Prefix of the numbered machine snapshot files, saved and loaded on request
+    local snapshotPathPrefix = os.getenv("SNAPSHOT_PATH_PREFIX") or "/tmp/daggorath-state"
+
+    -- Step marking: pause the machine between agent steps, and/or run a
+    -- fixed number of frames per step (0 = until the command is typed), or
+    -- end each step when its command settles
+    local lockstep = os.getenv("LOCKSTEP") == "1"
+    local framesPerStep = tonumber(os.getenv("FRAMES_PER_STEP") or "0") or 0
+    local settle = os.getenv("SETTLE") == "1"
+
+    -- Optional shared-state file (created by Python): the channels' latest
+    -- values at fixed offsets in place of change records on the FIFO
+    local sharedStatePath = os.getenv("SHARED_STATE_PATH") or ""
+    local sharedStateFile = nil
+    if sharedStatePath ~= "" then
+        sharedStateFile = io.open(sharedStatePath, "r+b")
+        if not sharedStateFile then
+            print("[daggorath] ERROR: Could not open shared state: " .. sharedStatePath)
+            return
+        end
+        print("[daggorath] Shared state opened: " .. sharedStatePath)
+    end
+
+    -- Per-channel sampling rates, in frames (0 = when the player changes floor)
+    local samplingRates = {}
+    for _, channel in ipairs({ "frame", "text", "maze", "creatures", "objects", "holes_ladders" }) do
+        samplingRates[channel] = tonumber(os.getenv("SAMPLING_RATE_" .. channel:upper()) or "1") or 1
+    end
+
     -- Hand off to domain modules
-    state.beginWatching(stateFile, { frame_sampling_rate = 1 })
-    commands.beginProcessing(commandSocket)
+    state.beginWatching(stateFile, {
+        frame_sampling_rate = 1,
+        command_notifier_calls = commands.notifierCalls,
+        lockstep = lockstep,
+        frames_per_step = framesPerStep,
+        settle = settle,
+        shared_state_file = sharedStateFile,
+        sampling_rates = samplingRates,
+    })
+    commands.beginProcessing(commandSocket, {
+        snapshot_path_prefix = snapshotPathPrefix,
+        lockstep = lockstep,
+        begin_step = state.beginStep,
+    })
 
     -- Save notifier subscriptions (GC fix: must store return values or GC auto-unsubscribes)
     resetSubscription = emu.add_machine_reset_notifier(_onReset)
     stopSubscription = emu.add_machine_stop_notifier(_onStop)
+    preSaveSubscription = emu.add_machine_pre_save_notifier(_onPreSave)
+    postLoadSubscription = emu.add_machine_post_load_notifier(_onPostLoad)
 
     print("[daggorath] Plugin ready")
 end
@@ -1,19 +1,87 @@
 -- State reporting module for Dungeons of Daggorath.
 -- Captures numeric game state and command-area pixels from RAM each frame,
--- dedups each against a snapshot, and writes tagged records to the state FIFO.
+-- dedups each against a snapshot, and writes one message per frame to the
+-- state FIFO.
 --
 -- Public API: state.beginWatching(stateFile, config)
 --   stateFile: FIFO file handle (io.open("w"))
---   config: { frame_sampling_rate = N } (default: 1 = every frame)
+--   config: { frame_sampling_rate = N,             (default: 1 = every frame)
+--             command_notifier_calls = function,   (running count of frames
+--                                                   the commands notifier saw)
+--             lockstep = boolean,                  (pause at each step end)
+--             frames_per_step = N,                 (default: 0 = no fixed steps)
+--             settle = boolean,                    (end steps when the command settles)
+--             shared_state_file = handle,          (io.open("r+b"); default: none)
+--             sampling_rates = { frame = N, text = N, maze = N, creatures = N,
+--                                objects = N, holes_ladders = N } }
+--                                                  (default: 1 each; see below)
+-- Public API: state.beginStep(typed) — commands.lua dispatched the next
+--   step, typing a command or (typed = false) letting the machine run
 --
--- Wire format (fixed-size, no delimiter — the pixel payload is binary):
---   "S" + 23-byte frame                              state only changed
---   "T" + 1-byte comColor + 1024 pixel bytes         text only changed
---   "B" + 23-byte frame + 1-byte comColor + 1024 px  both changed
---   "M" + 1024-byte maze                             maze changed
---   "C" + 128-byte creature array                    creatures changed
---   "O" + 70-byte object record                      objects changed
---   "H" + 24-byte holes/ladders record               holes/ladders changed
+-- Steps are marked when lockstep, frames_per_step, or settle is on. The
+-- first live frame ends a step; after that a step ends frames_per_step
+-- frames after its dispatch, or in settle mode once the command has
+-- settled, or otherwise on the first sampled frame once the keyboard has
+-- finished typing (at once for a step that typed nothing). The step-ended
+-- event rides on the envelope of the frame it ended on, and in lockstep the
+-- machine then pauses until commands.lua resumes it. Fixed-length steps
+-- sample only at the step end, so that one envelope carries every change
+-- the step made.
+--
+-- A command has settled when the keyboard is idle and the game has redrawn
+-- an empty prompt (".", then the "_" cursor) on the last command-area row
+-- after the row held something else — the game prints the prompt once the
+-- command has run, or once it has answered "???". A step that has not
+-- settled after SETTLE_FRAME_CAP frames ends anyway. Settled steps send the
+-- settled channel with their step-ended event.
+--
+-- Wire format: one envelope per emulated frame, plus one per snapshot save,
+-- snapshot load, and machine reset, each in a single write. A 16-byte little-endian header
+--   "DG"  u8 version (3)  u8 events  u32 frame  u16 epoch  u16 channels
+--   u16 payload length  u16 checksum
+-- is followed by the payload: the channels whose bit is set, in bit order.
+--   0x01 frame          23 bytes                 state changed
+--   0x02 text           1 comColor + 1024 px     text changed
+--   0x04 maze           1024 bytes               maze changed
+--   0x08 creatures      128 bytes                creatures changed
+--   0x10 objects        70 bytes                 objects changed
+--   0x20 holes/ladders  24 bytes                 holes/ladders changed
+--   0x40 clock          4 x u32 LE, every 60 frames: screen frames, state
+--                       notifier calls, commands notifier calls, microseconds
+--   0x80 settled        1 byte of flags: 0x01 perfectMatch fired,
+--                       0x02 frame cap hit
+--   0x100 creature delta  u8 count, then count x (u8 slot, 4 slot bytes)
+--   0x200 maze delta      u8 count, then count x (u16 LE cell index, u8 byte)
+-- A delta replaces its full channel when it is smaller, carrying only the
+-- creature slots or maze cells that changed since the last envelope. After
+-- DELTA_KEYFRAME_INTERVAL deltas in a row, the full channel is sent again.
+-- The events byte marks 0x01 snapshot saved, 0x02 snapshot loaded,
+-- 0x04 machine reset, 0x08 step ended. The frame number counts the frames
+-- this notifier ran since the epoch began; every reset and load begins a
+-- new epoch at frame 0. The checksum is the 16-bit sum of every header byte
+-- before it and every payload byte.
+--
+-- Shared state: with a shared_state_file, the state channels are not sent on
+-- the FIFO. Each keeps its latest value at a fixed offset of the file instead
+-- (the shared contract with emulator.py), and the envelopes carry only the
+-- events and reports. The file starts with nine u32 LE words:
+--   sequence      odd while a write is in progress, even once it is flushed
+--   epoch         the envelope epoch, bumped by every reset and load
+--   data epoch    the epoch the channels were last written in
+--   6 generations one per channel, bumped each time it is rewritten
+-- and the channels follow in order: frame (23), comColor + pixels (1025),
+-- maze (1024), creatures (128), objects (70), holes/ladders (24).
+--
+-- Dirty tracking: write taps on each state channel's RAM mark the channel
+-- dirty, and a frame samples and compares only the dirty channels. Every
+-- channel is sampled after a boot, reset, or load, and on one frame in
+-- TAP_AUDIT_INTERVAL regardless; without write-tap support, on every frame.
+--
+-- Sampling rates: a channel with rate N is sampled at most once every N
+-- frames, so its dirty bit can wait up to N - 1 frames. Rate 0 samples a
+-- channel only on the FLOOR_CHANGE_SAMPLES samples after atFloor changes
+-- (the game builds a new floor over several frames) or after a boot, reset,
+-- or load.
 
 local state = {}
 
@@ -101,6 +169,76 @@ local HOLE_LADDER_SENTINEL = 0xFF
 local EMPTY_HOLE_LADDER = string.char(
     HOLE_LADDER_SENTINEL, HOLE_LADDER_SENTINEL, HOLE_LADDER_SENTINEL)
 
+-- Settle detection: perfectMatch goes non-zero when the parser matches a
+-- command; the prompt is "." then the "_" cursor (7-row font patterns).
+local PERFECT_MATCH = 0x027B
+local PROMPT_ROW = TEXT_ROWS - 1
+local GLYPH_ROWS = 7
+local PROMPT_PATTERN = { 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x04 }
+local CURSOR_PATTERN = { 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x1F }
+local SETTLE_FRAME_CAP = 600
+local SETTLED_MATCHED = 0x01
+local SETTLED_CAPPED = 0x02
+
+-- Clock report cadence, in frames this notifier saw run.
+local CLOCK_INTERVAL = 60
+local U32_MAX = 0xFFFFFFFF
+local U16_MAX = 0xFFFF
+
+-- Message envelope (the shared contract with emulator.py): the header up to
+-- the checksum, then the u16 checksum itself.
+local MESSAGE_MAGIC = "DG"
+local MESSAGE_VERSION = 3
+local MESSAGE_HEADER_FORMAT = "<c2BBI4I2I2I2"
+local CHANNEL_FRAME = 0x01
+local CHANNEL_TEXT = 0x02
+local CHANNEL_MAZE = 0x04
+local CHANNEL_CREATURES = 0x08
+local CHANNEL_OBJECTS = 0x10
+local CHANNEL_HOLES_LADDERS = 0x20
+local CHANNEL_CLOCK = 0x40
+local CHANNEL_SETTLED = 0x80
+local CHANNEL_CREATURE_DELTA = 0x100
+local CHANNEL_MAZE_DELTA = 0x200
+local EVENT_SNAPSHOT_SAVED = 0x01
+local EVENT_SNAPSHOT_LOADED = 0x02
+local EVENT_MACHINE_RESET = 0x04
+local EVENT_STEP_ENDED = 0x08
+local MESSAGE_CHANNELS = {
+    CHANNEL_FRAME, CHANNEL_TEXT, CHANNEL_MAZE, CHANNEL_CREATURES,
+    CHANNEL_OBJECTS, CHANNEL_HOLES_LADDERS, CHANNEL_CLOCK, CHANNEL_SETTLED,
+    CHANNEL_CREATURE_DELTA, CHANNEL_MAZE_DELTA,
+}
+
+-- Delta channels: the most entries each count byte allows, and how many
+-- deltas in a row a channel sends before its full record goes out again,
+-- so a reader that lost a record to a resync catches up.
+local CREATURE_DELTA_ENTRY_BYTES = 1 + CREATURE_FIELDS
+local MAZE_DELTA_ENTRY_BYTES = 3
+local DELTA_MAX_ENTRIES = 255
+local DELTA_KEYFRAME_INTERVAL = 60
+local MAZE_ROW_BYTES = 32
+local STATE_CHANNELS = CHANNEL_FRAME | CHANNEL_TEXT | CHANNEL_MAZE
+    | CHANNEL_CREATURES | CHANNEL_OBJECTS | CHANNEL_HOLES_LADDERS
+
+-- Sampling-rate names (the shared contract with SamplingRates in Python).
+local SAMPLING_CHANNELS = {
+    frame = CHANNEL_FRAME,
+    text = CHANNEL_TEXT,
+    maze = CHANNEL_MAZE,
+    creatures = CHANNEL_CREATURES,
+    objects = CHANNEL_OBJECTS,
+    holes_ladders = CHANNEL_HOLES_LADDERS,
+}
+local ON_FLOOR_CHANGE = 0
+local FLOOR_CHANGE_SAMPLES = 60
+
+-- Write taps. The audit re-samples every channel now and then, in case a
+-- change reached RAM without a tapped CPU write (a tap that lagged a moved
+-- range, a pointer into untapped RAM).
+local TAP_NAME = "daggorath-state"
+local TAP_AUDIT_INTERVAL = 60
+
 -- Schema: ordered array of { name, addr, width } tables. The lit torch's three
 -- fields use { name, torchOffset, width } instead of addr — they are read
 -- through torchPtr, the game's pointer to the lit torch (0 = none lit).
@@ -127,6 +265,35 @@ local SCHEMA = {
     { name = "displayFunction",      addr = 0x02B2, width = 2 },
 }
 
+local FRAME_BYTES = 0
+for _, field in ipairs(SCHEMA) do
+    FRAME_BYTES = FRAME_BYTES + field.width
+end
+
+-- Shared-state layout: the header words, then each channel at a fixed offset.
+local SHARED_SEQUENCE_OFFSET = 0
+local SHARED_EPOCH_OFFSET = 4
+local SHARED_DATA_EPOCH_OFFSET = 8
+local SHARED_GENERATIONS_OFFSET = 12
+local SHARED_FRAME = 1
+local SHARED_TEXT = 2
+local SHARED_MAZE = 3
+local SHARED_CREATURES = 4
+local SHARED_OBJECTS = 5
+local SHARED_HOLES_LADDERS = 6
+local SHARED_CHANNEL_BYTES = {
+    FRAME_BYTES, 1 + TOTAL_SCANLINES * CHARS_PER_ROW, MAZE_BYTES,
+    CREATURE_BYTES, OBJECTS_BYTES, HOLES_LADDERS_BYTES,
+}
+local SHARED_CHANNEL_OFFSETS = {}
+do
+    local offset = SHARED_GENERATIONS_OFFSET + 4 * #SHARED_CHANNEL_BYTES
+    for channel, bytes in ipairs(SHARED_CHANNEL_BYTES) do
+        SHARED_CHANNEL_OFFSETS[channel] = offset
+        offset = offset + bytes
+    end
+end
+
 -- Internal state
 local _stateFile = nil
 local _memory = nil
@@ -140,6 +307,44 @@ local _creatureSnapshot = nil
 local _objectSnapshot = nil
 local _holesLaddersSnapshot = nil
 local _frameSubscription = nil
+local _commandNotifierCalls = nil
+local _clockNotifierCalls = 0
+local _clockScreenFrame = nil
+local _clockCommandCalls = nil
+local _clockTicks = nil
+local _lockstep = false
+local _framesPerStep = 0
+local _settle = false
+local _stepOpen = true
+local _stepOpenedByBoot = true
+local _stepTyped = false
+local _stepFrames = 0
+local _perfectMatchSeen = false
+local _promptLeft = false
+local _reachedLive = false
+local _frameNumber = 0
+local _epoch = 0
+local _messageEvents = 0
+local _messageChannels = 0
+local _messagePayloads = {}
+local _messagePieces = {}
+local _sharedFile = nil
+local _sharedSequence = 0
+local _sharedGenerations = { 0, 0, 0, 0, 0, 0 }
+local _dirtyChannels = STATE_CHANNELS
+local _taps = {}
+local _tapsInstalled = false
+local _tapsActive = false
+local _tappedAreaStart = nil
+local _tappedArenaEnd = nil
+local _framesSinceAudit = 0
+local _samplingRates = {}
+local _floorChannels = 0
+local _floorSamplesLeft = 0
+local _sampledFloor = nil
+local _channelSampledAt = {}
+local _creatureDeltaRun = 0
+local _mazeDeltaRun = 0
 
 local function _getMemorySpace()
     local cpu = nil
@@ -155,12 +360,19 @@ local function _getMemorySpace()
     return nil
 end
 
+local function _getScreen()
+    for _, screen in pairs(manager.machine.screens) do
+        return screen
+    end
+    return nil
+end
+
 local function _isLive()
     local fn = _memory:read_u8(DISPLAY_FN_HI) * 256 + _memory:read_u8(DISPLAY_FN_LO)
     return fn == DISPLAY_LOOK or fn == DISPLAY_EXAMINE
 end
 
--- Read all fields and serialize as a 21-byte string. Returns nil if any read
+-- Read all fields and serialize as a FRAME_BYTES-byte string. Returns nil if any read
 -- fails, so the caller can skip the frame instead of crashing.
 local function _sampleState()
     local ok, result = pcall(function()
@@ -195,20 +407,17 @@ local function _sampleState()
     return result
 end
 
--- Read the command-area pixel block as a flat 1024-byte string.
+-- Read count bytes from start as one string, in a single native call.
+local function _readBlock(start, count)
+    return _memory:read_range(start, start + count - 1, 8)
+end
+
+-- Read the command-area pixel block as a flat 1024-byte string. Its
+-- scanlines are contiguous, CHARS_PER_ROW bytes apart.
 local function _readCommandAreaPixels()
     local areaStart = _memory:read_u8(COM_START_HI) * 256
         + _memory:read_u8(COM_START_LO)
-
-    local pixels = {}
-    for scanline = 0, TOTAL_SCANLINES - 1 do
-        local scanlineStart = areaStart + scanline * CHARS_PER_ROW
-        for column = 0, CHARS_PER_ROW - 1 do
-            pixels[#pixels + 1] = string.char(
-                _memory:read_u8(scanlineStart + column))
-        end
-    end
-    return table.concat(pixels)
+    return _readBlock(areaStart, TOTAL_SCANLINES * CHARS_PER_ROW)
 end
 
 -- Read an object's identity bytes (class, proper type, reveal threshold).
@@ -226,29 +435,25 @@ end
 
 -- Read the maze as a flat 1024-byte string (row-major, one byte per cell).
 local function _sampleMaze()
-    local ok, result = pcall(function()
-        local bytes = {}
-        for offset = 0, MAZE_BYTES - 1 do
-            bytes[#bytes + 1] = string.char(_memory:read_u8(MAZE_START + offset))
-        end
-        return table.concat(bytes)
-    end)
+    local ok, result = pcall(_readBlock, MAZE_START, MAZE_BYTES)
     if not ok then return nil end
     return result
 end
 
 -- Read the creature array as a flat 128-byte string: per slot, alive, type,
--- X, Y (the wire order matches the perceived channel).
+-- X, Y (the wire order matches the perceived channel). The slots are read
+-- in one block and picked apart in Lua.
 local function _sampleCreatures()
     local ok, result = pcall(function()
+        local block = _readBlock(CREATURE_ARRAY_START, CREATURE_SLOTS * CREATURE_SLOT_BYTES)
         local bytes = {}
         for slot = 0, CREATURE_SLOTS - 1 do
-            local base = CREATURE_ARRAY_START + slot * CREATURE_SLOT_BYTES
+            local base = slot * CREATURE_SLOT_BYTES + 1
             bytes[#bytes + 1] = string.char(
-                _memory:read_u8(base + CREATURE_ALIVE_OFFSET),
-                _memory:read_u8(base + CREATURE_TYPE_OFFSET),
-                _memory:read_u8(base + CREATURE_X_OFFSET),
-                _memory:read_u8(base + CREATURE_Y_OFFSET))
+                block:byte(base + CREATURE_ALIVE_OFFSET),
+                block:byte(base + CREATURE_TYPE_OFFSET),
+                block:byte(base + CREATURE_X_OFFSET),
+                block:byte(base + CREATURE_Y_OFFSET))
         end
         return table.concat(bytes)
     end)
@@ -287,22 +492,31 @@ local function _sampleObjects()
             end
         end
 
-        -- Floor: arena scan for location 0 on the current level.
+        -- Floor: arena scan for location 0 on the current level, over the
+        -- allocated slots read in one block.
         local nextObjSlot = _memory:read_u8(NEXT_OBJ_SLOT_HI) * 256
             + _memory:read_u8(NEXT_OBJ_SLOT_LO)
         local currentLevel = _memory:read_u8(CURRENT_LEVEL_ADDR)
+        local slots = math.max(0,
+            (nextObjSlot - OBJECT_ARRAY_BASE + OBJECT_SLOT_BYTES - 1) // OBJECT_SLOT_BYTES)
+        local arena = ""
+        if slots > 0 then
+            arena = _readBlock(OBJECT_ARRAY_BASE, slots * OBJECT_SLOT_BYTES)
+        end
         local floorCount = 0
-        local slot = OBJECT_ARRAY_BASE
-        while slot < nextObjSlot and floorCount < FLOOR_OBJECT_CAPACITY do
-            if _memory:read_u8(slot + OBJECT_LOCATION_OFFSET) == 0
-                and _memory:read_u8(slot + OBJECT_LEVEL_OFFSET) == currentLevel then
-                bytes[#bytes + 1] = _readObjectIdentity(slot)
+        local base = 1
+        while base < #arena and floorCount < FLOOR_OBJECT_CAPACITY do
+            if arena:byte(base + OBJECT_LOCATION_OFFSET) == 0
+                and arena:byte(base + OBJECT_LEVEL_OFFSET) == currentLevel then
                 bytes[#bytes + 1] = string.char(
-                    _memory:read_u8(slot + OBJECT_X_OFFSET),
-                    _memory:read_u8(slot + OBJECT_Y_OFFSET))
+                    arena:byte(base + OBJECT_CLASS_OFFSET),
+                    arena:byte(base + OBJECT_PROPER_OFFSET),
+                    arena:byte(base + OBJECT_REVEAL_OFFSET),
+                    arena:byte(base + OBJECT_X_OFFSET),
+                    arena:byte(base + OBJECT_Y_OFFSET))
                 floorCount = floorCount + 1
             end
-            slot = slot + OBJECT_SLOT_BYTES
+            base = base + OBJECT_SLOT_BYTES
         end
         for _ = floorCount, FLOOR_OBJECT_CAPACITY - 1 do
             bytes[#bytes + 1] = EMPTY_FLOOR_OBJECT
@@ -351,131 +565,629 @@ local function _sampleHolesLadders()
     return result
 end
 
--- Write one tagged record to the FIFO in a single call.
-local function _writeRecord(kind, frame, comColor, pixels)
-    local pieces = { kind }
-    if frame then
-        pieces[#pieces + 1] = frame
+-- The 16-bit sum of a string's bytes.
+local function _checksum(data)
+    local sum = 0
+    for index = 1, #data do
+        sum = sum + data:byte(index)
     end
-    if comColor then
-        pieces[#pieces + 1] = string.char(comColor)
-    end
-    if pixels then
-        pieces[#pieces + 1] = pixels
+    return sum & U16_MAX
+end
+
+-- Add a channel's payload to this frame's envelope.
+local function _queueChannel(channel, payload)
+    _messageChannels = _messageChannels | channel
+    _messagePayloads[channel] = payload
+end
+
+-- Add an event to this frame's envelope.
+local function _queueEvent(event)
+    _messageEvents = _messageEvents | event
+end
+
+-- Write the queued channels and events to the FIFO as one envelope and
+-- start the next one empty. The pieces go into the file's buffer (sized by
+-- init.lua to hold the largest envelope) and leave in the one write(2) the
+-- flush makes, which a pipe delivers whole. A channel's payload stays in
+-- _messagePayloads until replaced; only its bit says it was queued.
+local function _writeMessage()
+    local count = 0
+    local length = 0
+    local checksum = 0
+    for _, channel in ipairs(MESSAGE_CHANNELS) do
+        if _messageChannels & channel ~= 0 then
+            local payload = _messagePayloads[channel]
+            count = count + 1
+            _messagePieces[count] = payload
+            length = length + #payload
+            checksum = checksum + _checksum(payload)
+        end
     end
+    local header = string.pack(MESSAGE_HEADER_FORMAT,
+        MESSAGE_MAGIC, MESSAGE_VERSION, _messageEvents, _frameNumber,
+        _epoch & U16_MAX, _messageChannels, length)
+    checksum = (checksum + _checksum(header)) & U16_MAX
 
-    local ok = pcall(function()
-        _stateFile:write(table.concat(pieces))
-        _stateFile:flush()
-    end)
+    local ok = pcall(_stateFile.write, _stateFile,
+        header, string.pack("<I2", checksum), table.unpack(_messagePieces, 1, count))
+    ok = ok and pcall(_stateFile.flush, _stateFile)
     if not ok then
-        print("[state] Failed to write record " .. kind)
+        print("[state] Failed to write frame " .. _frameNumber)
+    end
+
+    _messageEvents = 0
+    _messageChannels = 0
+end
+
+-- Queue the creature array, as a delta of the changed slots when the last
+-- envelope's array is known and the delta is smaller.
+local function _queueCreatures(creatures)
+    if _creatureSnapshot and _creatureDeltaRun < DELTA_KEYFRAME_INTERVAL then
+        local entries = {}
+        for slot = 0, CREATURE_SLOTS - 1 do
+            local first = slot * CREATURE_FIELDS + 1
+            local last = first + CREATURE_FIELDS - 1
+            local fields = creatures:sub(first, last)
+            if fields ~= _creatureSnapshot:sub(first, last) then
+                entries[#entries + 1] = string.char(slot) .. fields
+            end
+        end
+        if 1 + #entries * CREATURE_DELTA_ENTRY_BYTES < CREATURE_BYTES then
+            _queueChannel(CHANNEL_CREATURE_DELTA, string.char(#entries) .. table.concat(entries))
+            _creatureDeltaRun = _creatureDeltaRun + 1
+            return
+        end
+    end
+    _queueChannel(CHANNEL_CREATURES, creatures)
+    _creatureDeltaRun = 0
+end
+
+-- Queue the maze, as a delta of the changed cells when the last envelope's
+-- maze is known and the delta is smaller. Rows are compared whole first.
+local function _queueMaze(maze)
+    if _mazeSnapshot and _mazeDeltaRun < DELTA_KEYFRAME_INTERVAL then
+        local entries = {}
+        for row = 0, MAZE_BYTES // MAZE_ROW_BYTES - 1 do
+            local first = row * MAZE_ROW_BYTES + 1
+            local last = first + MAZE_ROW_BYTES - 1
+            if maze:sub(first, last) ~= _mazeSnapshot:sub(first, last) then
+                for index = first, last do
+                    local value = maze:byte(index)
+                    if value ~= _mazeSnapshot:byte(index) then
+                        entries[#entries + 1] = string.pack("<I2B", index - 1, value)
+                    end
+                end
+            end
+            if #entries > DELTA_MAX_ENTRIES then
+                break
+            end
+        end
+        if #entries <= DELTA_MAX_ENTRIES
+            and 1 + #entries * MAZE_DELTA_ENTRY_BYTES < MAZE_BYTES then
+            _queueChannel(CHANNEL_MAZE_DELTA, string.char(#entries) .. table.concat(entries))
+            _mazeDeltaRun = _mazeDeltaRun + 1
+            return
+        end
     end
+    _queueChannel(CHANNEL_MAZE, maze)
+    _mazeDeltaRun = 0
 end
 
--- Write one fixed-size world record to the FIFO in a single call.
-local function _writeWorldRecord(kind, payload)
+-- Write one u32 LE word into the shared-state file.
+local function _writeSharedWord(offset, value)
+    _sharedFile:seek("set", offset)
+    _sharedFile:write(string.pack("<I4", value))
+end
+
+-- Run update() under the shared-state sequence number: odd while its writes
+-- are in flight, even again once they are flushed, so a reader that sees the
+-- same even number before and after its copy holds a consistent snapshot.
+local function _writeShared(update)
     local ok = pcall(function()
-        _stateFile:write(kind .. payload)
-        _stateFile:flush()
+        _sharedSequence = (_sharedSequence + 1) & U32_MAX
+        _writeSharedWord(SHARED_SEQUENCE_OFFSET, _sharedSequence)
+        _sharedFile:flush()
+        update()
+        _sharedFile:flush()
+        _sharedSequence = (_sharedSequence + 1) & U32_MAX
+        _writeSharedWord(SHARED_SEQUENCE_OFFSET, _sharedSequence)
+        _sharedFile:flush()
     end)
     if not ok then
-        print("[state] Failed to write record " .. kind)
+        print("[state] Failed to write shared state")
     end
 end
 
--- Per-frame notifier: sample, dedup, and write tagged records.
-local function _onFrame()
-    _framesElapsed = _framesElapsed + 1
+-- Write the changed channels (channel -> payload) into the shared-state file.
+local function _writeSharedChannels(changes)
+    _writeShared(function()
+        _writeSharedWord(SHARED_DATA_EPOCH_OFFSET, _epoch)
+        for channel, payload in pairs(changes) do
+            _sharedGenerations[channel] = (_sharedGenerations[channel] + 1) & U32_MAX
+            _writeSharedWord(SHARED_GENERATIONS_OFFSET + 4 * (channel - 1),
+                _sharedGenerations[channel])
+            _sharedFile:seek("set", SHARED_CHANNEL_OFFSETS[channel])
+            _sharedFile:write(payload)
+        end
+    end)
+end
 
-    if manager.machine.paused then
+-- Start a new epoch at frame 0 after a reset or load. Shared-state channels
+-- predate it until the next live frame rewrites them.
+local function _advanceEpoch()
+    _epoch = (_epoch + 1) & U32_MAX
+    _frameNumber = 0
+    if not _sharedFile then
         return
     end
+    _writeShared(function()
+        _writeSharedWord(SHARED_EPOCH_OFFSET, _epoch)
+    end)
+end
 
-    -- Re-acquire the memory space every frame: MAME rebuilds the machine on
-    -- reset, invalidating the previously cached space.
-    _memory = _getMemorySpace()
-    if not _memory then
-        return
+-- Forget every channel snapshot so the next live frame re-sends them all.
+local function _clearSnapshots()
+    _stateSnapshot = nil
+    _pixelSnapshot = nil
+    _comColorSnapshot = nil
+    _mazeSnapshot = nil
+    _creatureSnapshot = nil
+    _objectSnapshot = nil
+    _holesLaddersSnapshot = nil
+    _dirtyChannels = STATE_CHANNELS
+    _sampledFloor = nil
+    _channelSampledAt = {}
+end
+
+-- Install the named write tap over first..last, replacing any earlier one:
+-- a CPU write anywhere in the range marks the channels dirty. _taps holds
+-- the handlers, which keeps the taps installed.
+local function _tap(name, first, last, channels)
+    if _taps[name] then
+        _taps[name]:remove()
     end
+    _taps[name] = _memory:install_write_tap(first, last, TAP_NAME .. "-" .. name,
+        function(offset, data, mask)
+            _dirtyChannels = _dirtyChannels | channels
+        end)
+end
 
-    -- Skip frames that aren't multiples of the sampling rate
-    if _framesElapsed % _frameSamplingRate ~= 0 then
-        return
+-- Remove every write tap; until they are reinstalled, every channel is
+-- sampled on every frame.
+local function _removeTaps()
+    for name, handler in pairs(_taps) do
+        pcall(handler.remove, handler)
+        _taps[name] = nil
     end
+    _tapsActive = false
+    _tappedAreaStart = nil
+    _tappedArenaEnd = nil
+end
 
-    -- Readiness gate: only sample during live play (LOOK or EXAMINE).
-    if not _isLive() then
-        return
+-- Install the taps on each channel's fixed RAM. The command-area pixels and
+-- the object arena move, so _followMovingTaps places those.
+local function _installTaps()
+    _tapsInstalled = true
+    _tapsActive = pcall(function()
+        for _, field in ipairs(SCHEMA) do
+            if field.addr then
+                _tap(field.name, field.addr, field.addr + field.width - 1, CHANNEL_FRAME)
+            end
+        end
+        _tap("torchPtr", TORCH_PTR_HI, TORCH_PTR_LO, CHANNEL_FRAME)
+        _tap("comArea", COM_START_HI, COM_COLOR, CHANNEL_TEXT)
+        _tap("maze", MAZE_START, MAZE_START + MAZE_BYTES - 1, CHANNEL_MAZE)
+        _tap("creatures", CREATURE_ARRAY_START,
+            CREATURE_ARRAY_START + CREATURE_SLOTS * CREATURE_SLOT_BYTES - 1, CHANNEL_CREATURES)
+        _tap("nextObjSlot", NEXT_OBJ_SLOT_HI, NEXT_OBJ_SLOT_LO, CHANNEL_OBJECTS)
+        _tap("hands", LEFT_HAND_HI, RIGHT_HAND_LO, CHANNEL_OBJECTS)
+        _tap("pack", FIRST_PACK_HI, FIRST_PACK_LO, CHANNEL_OBJECTS)
+        _tap("level", CURRENT_LEVEL_ADDR, CURRENT_LEVEL_ADDR, CHANNEL_OBJECTS)
+        _tap("holes", CURRENT_HOLES_HI, CURRENT_HOLES_LO, CHANNEL_HOLES_LADDERS)
+    end)
+    if not _tapsActive then
+        _removeTaps()
+        print("[state] Write taps unavailable; sampling every channel every frame")
     end
+end
 
-    local frame = _sampleState()
-    if not frame then
+-- Keep the moving taps on their ranges: the command-area pixels at
+-- comStart, and the allocated object slots up to nextObjSlot, which also
+-- hold the lit torch's fields. A write to either pointer has already
+-- marked its channel dirty.
+local function _followMovingTaps()
+    local areaStart = _memory:read_u8(COM_START_HI) * 256
+        + _memory:read_u8(COM_START_LO)
+    if areaStart ~= _tappedAreaStart then
+        _tap("comPixels", areaStart, areaStart + TOTAL_SCANLINES * CHARS_PER_ROW - 1, CHANNEL_TEXT)
+        _tappedAreaStart = areaStart
+    end
+
+    local nextObjSlot = _memory:read_u8(NEXT_OBJ_SLOT_HI) * 256
+        + _memory:read_u8(NEXT_OBJ_SLOT_LO)
+    local slots = math.max(0,
+        (nextObjSlot - OBJECT_ARRAY_BASE + OBJECT_SLOT_BYTES - 1) // OBJECT_SLOT_BYTES)
+    local arenaEnd = OBJECT_ARRAY_BASE + slots * OBJECT_SLOT_BYTES
+    if arenaEnd ~= _tappedArenaEnd and slots > 0 then
+        _tap("arena", OBJECT_ARRAY_BASE, arenaEnd - 1, CHANNEL_FRAME | CHANNEL_OBJECTS)
+        _tappedArenaEnd = arenaEnd
+    end
+end
+
+-- The channels due a sample this frame: each whose rate has passed since
+-- its last sample, and the floor-change channels while a new floor arrives.
+local function _dueChannels()
+    local due = 0
+    if _floorChannels ~= 0 then
+        local floor = _memory:read_u8(CURRENT_LEVEL_ADDR)
+        if floor ~= _sampledFloor then
+            _sampledFloor = floor
+            _floorSamplesLeft = FLOOR_CHANGE_SAMPLES
+        end
+        if _floorSamplesLeft > 0 then
+            _floorSamplesLeft = _floorSamplesLeft - 1
+            due = _floorChannels
+        end
+    end
+
+    for channel, rate in pairs(_samplingRates) do
+        local sampledAt = _channelSampledAt[channel]
+        if rate ~= ON_FLOOR_CHANGE
+            and (sampledAt == nil or _framesElapsed - sampledAt >= rate) then
+            due = due | channel
+        end
+    end
+    return due
+end
+
+-- Sample a channel if it is dirty; a failed read leaves it dirty.
+local function _sampleIfDirty(dirty, channel, sample)
+    if dirty & channel == 0 then
+        return nil
+    end
+    local value = sample()
+    if not value then
+        _dirtyChannels = _dirtyChannels | channel
+    end
+    return value
+end
+
+-- Restart the clock interval: the next report only sets a new baseline.
+local function _resetClock()
+    _clockNotifierCalls = 0
+    _clockScreenFrame = nil
+end
+
+-- Report how many frames the screen and both notifiers saw since the last
+-- report, and the host time that took, then start a new interval.
+local function _reportClock()
+    local screen = _getScreen()
+    if not screen then
         return
     end
 
-    local stateChanged = (_stateSnapshot == nil) or (frame ~= _stateSnapshot)
+    local screenFrame = screen:frame_number()
+    local commandCalls = _commandNotifierCalls and _commandNotifierCalls() or 0
+    local ticks = emu.osd_ticks()
 
-    local pixels = _readCommandAreaPixels()
-    local comColor = _memory:read_u8(COM_COLOR)
-    local pixelChanged = (_pixelSnapshot == nil)
-        or (pixels ~= _pixelSnapshot)
-        or (comColor ~= _comColorSnapshot)
+    if _clockScreenFrame then
+        local microseconds = (ticks - _clockTicks) * 1000000 // emu.osd_ticks_per_second()
+        _queueChannel(CHANNEL_CLOCK, string.pack("<I4I4I4I4",
+            math.max(0, screenFrame - _clockScreenFrame),
+            _clockNotifierCalls,
+            math.max(0, commandCalls - _clockCommandCalls),
+            math.min(microseconds, U32_MAX)))
+    end
 
-    if stateChanged and pixelChanged then
-        _writeRecord("B", frame, comColor, pixels)
-        _stateSnapshot = frame
-        _pixelSnapshot = pixels
-        _comColorSnapshot = comColor
-    elseif stateChanged then
-        _writeRecord("S", frame, nil, nil)
-        _stateSnapshot = frame
-    elseif pixelChanged then
-        _writeRecord("T", nil, comColor, pixels)
-        _pixelSnapshot = pixels
-        _comColorSnapshot = comColor
+    _clockNotifierCalls = 0
+    _clockScreenFrame = screenFrame
+    _clockCommandCalls = commandCalls
+    _clockTicks = ticks
+end
+
+-- Sample the dirty channels, dedup each against its snapshot, and write the
+-- changed ones: into this frame's envelope, or into the shared-state file.
+local function _writeChangedChannels()
+    if not _tapsInstalled then
+        _installTaps()
+    end
+    if _tapsActive and _dirtyChannels & (CHANNEL_TEXT | CHANNEL_OBJECTS) ~= 0
+        and not pcall(_followMovingTaps) then
+        _removeTaps()
+        print("[state] Failed to move write taps; sampling every channel every frame")
+    end
+    local due = _dueChannels()
+    local dirty = _dirtyChannels & due
+    _dirtyChannels = _dirtyChannels & ~due
+
+    local frame = _stateSnapshot
+    if dirty & CHANNEL_FRAME ~= 0 then
+        frame = _sampleState()
+        if not frame then
+            _dirtyChannels = _dirtyChannels | dirty
+            return
+        end
+    end
+    local stateChanged = frame ~= _stateSnapshot
+
+    local pixels = _pixelSnapshot
+    local comColor = _comColorSnapshot
+    if dirty & CHANNEL_TEXT ~= 0 then
+        pixels = _readCommandAreaPixels()
+        comColor = _memory:read_u8(COM_COLOR)
     end
-    -- else: nothing changed — write no record
+    local pixelChanged = (pixels ~= _pixelSnapshot) or (comColor ~= _comColorSnapshot)
 
     -- World channels: maze, creatures, and objects are each compared to their
     -- own snapshot and written only when they differ.
-    local maze = _sampleMaze()
-    if maze and maze ~= _mazeSnapshot then
-        _writeWorldRecord("M", maze)
-        _mazeSnapshot = maze
+    local maze = _sampleIfDirty(dirty, CHANNEL_MAZE, _sampleMaze)
+    local mazeChanged = maze and maze ~= _mazeSnapshot
+    local creatures = _sampleIfDirty(dirty, CHANNEL_CREATURES, _sampleCreatures)
+    local creaturesChanged = creatures and creatures ~= _creatureSnapshot
+    local objects = _sampleIfDirty(dirty, CHANNEL_OBJECTS, _sampleObjects)
+    local objectsChanged = objects and objects ~= _objectSnapshot
+    local holesLadders = _sampleIfDirty(dirty, CHANNEL_HOLES_LADDERS, _sampleHolesLadders)
+    local holesLaddersChanged = holesLadders and holesLadders ~= _holesLaddersSnapshot
+
+    if _sharedFile then
+        local changes = {}
+        if stateChanged then
+            changes[SHARED_FRAME] = frame
+        end
+        if pixelChanged then
+            changes[SHARED_TEXT] = string.char(comColor) .. pixels
+        end
+        if mazeChanged then
+            changes[SHARED_MAZE] = maze
+        end
+        if creaturesChanged then
+            changes[SHARED_CREATURES] = creatures
+        end
+        if objectsChanged then
+            changes[SHARED_OBJECTS] = objects
+        end
+        if holesLaddersChanged then
+            changes[SHARED_HOLES_LADDERS] = holesLadders
+        end
+        if next(changes) then
+            _writeSharedChannels(changes)
+        end
+    else
+        if stateChanged then
+            _queueChannel(CHANNEL_FRAME, frame)
+        end
+        if pixelChanged then
+            _queueChannel(CHANNEL_TEXT, string.char(comColor) .. pixels)
+        end
+        if mazeChanged then
+            _queueMaze(maze)
+        end
+        if creaturesChanged then
+            _queueCreatures(creatures)
+        end
+        if objectsChanged then
+            _queueChannel(CHANNEL_OBJECTS, objects)
+        end
+        if holesLaddersChanged then
+            _queueChannel(CHANNEL_HOLES_LADDERS, holesLadders)
+        end
     end
 
-    local creatures = _sampleCreatures()
-    if creatures and creatures ~= _creatureSnapshot then
-        _writeWorldRecord("C", creatures)
+    if stateChanged then
+        _stateSnapshot = frame
+    end
+    if pixelChanged then
+        _pixelSnapshot = pixels
+        _comColorSnapshot = comColor
+    end
+    if mazeChanged then
+        _mazeSnapshot = maze
+    end
+    if creaturesChanged then
         _creatureSnapshot = creatures
     end
-
-    local objects = _sampleObjects()
-    if objects and objects ~= _objectSnapshot then
-        _writeWorldRecord("O", objects)
+    if objectsChanged then
         _objectSnapshot = objects
     end
-
-    local holesLadders = _sampleHolesLadders()
-    if holesLadders and holesLadders ~= _holesLaddersSnapshot then
-        _writeWorldRecord("H", holesLadders)
+    if holesLaddersChanged then
         _holesLaddersSnapshot = holesLadders
     end
+
+    for channel in pairs(_samplingRates) do
+        if dirty & channel ~= 0 then
+            _channelSampledAt[channel] = _framesElapsed
+        end
+    end
+end
+
+-- Open a step. One opened by a boot, reset, or load has no command to wait
+-- for, so it ends on the first live frame.
+local function _openStep(byBoot, typed)
+    _stepOpen = true
+    _stepOpenedByBoot = byBoot
+    _stepTyped = typed
+    _stepFrames = 0
+    _perfectMatchSeen = false
+    _promptLeft = false
+end
+
+-- Whether a command-area glyph matches a 7-row font pattern.
+local function _glyphMatches(textRow, column, comColor, pattern)
+    local areaStart = _memory:read_u8(COM_START_HI) * 256
+        + _memory:read_u8(COM_START_LO)
+    local glyphStart = areaStart + textRow * SCANLINES_PER_ROW * CHARS_PER_ROW + column
+    for scanline = 0, GLYPH_ROWS - 1 do
+        local byte = _memory:read_u8(glyphStart + scanline * CHARS_PER_ROW)
+        if ((byte ~ comColor) >> 2) & 0x1F ~= pattern[scanline + 1] then
+            return false
+        end
+    end
+    return true
+end
+
+-- Whether the last command-area row is an empty prompt awaiting input.
+local function _isPromptEmpty()
+    local comColor = _memory:read_u8(COM_COLOR)
+    return _glyphMatches(PROMPT_ROW, 0, comColor, PROMPT_PATTERN)
+        and _glyphMatches(PROMPT_ROW, 1, comColor, CURSOR_PATTERN)
+end
+
+-- Settle mode: note whether the parser matched, and whether the prompt row
+-- has left its empty state, on every frame of a command's step.
+local function _watchSettle()
+    if _memory:read_u8(PERFECT_MATCH) ~= 0 then
+        _perfectMatchSeen = true
+    end
+    if not _isPromptEmpty() then
+        _promptLeft = true
+    end
+end
+
+-- Whether the open step has run its course: its frame count when steps are
+-- fixed-length, the command settling (or the frame cap) in settle mode,
+-- else (lockstep) until the keyboard has finished typing.
+local function _isStepDue()
+    if _stepOpenedByBoot then
+        return true
+    end
+    if _framesPerStep > 0 then
+        return _stepFrames >= _framesPerStep
+    end
+
+    local keyboard = manager.machine.natkeyboard
+    local typing = keyboard and keyboard.is_posting
+    if _settle then
+        if not _stepTyped then
+            return true
+        end
+        if _stepFrames >= SETTLE_FRAME_CAP then
+            return true
+        end
+        return not typing and _promptLeft and _isPromptEmpty()
+    end
+    return _lockstep and not typing
+end
+
+-- Mark the step's end in this frame's envelope; in lockstep, pause until
+-- commands.lua resumes the machine for the next step.
+local function _endStep()
+    if _settle and not _stepOpenedByBoot then
+        local flags = 0
+        if _perfectMatchSeen then
+            flags = flags | SETTLED_MATCHED
+        end
+        if _stepFrames >= SETTLE_FRAME_CAP then
+            flags = flags | SETTLED_CAPPED
+        end
+        _queueChannel(CHANNEL_SETTLED, string.char(flags))
+    end
+
+    _stepOpen = false
+    _queueEvent(EVENT_STEP_ENDED)
+    if _lockstep then
+        emu.pause()
+    end
+end
+
+-- Sample, dedup, and queue this frame's channels and events.
+local function _sampleFrame()
+    -- Clock: count every emulated frame, live or not.
+    _clockNotifierCalls = _clockNotifierCalls + 1
+    if _clockNotifierCalls >= CLOCK_INTERVAL then
+        _reportClock()
+    end
+
+    if _stepOpen then
+        _stepFrames = _stepFrames + 1
+    end
+
+    -- Re-acquire the memory space every frame: MAME rebuilds the machine on
+    -- reset, invalidating the previously cached space.
+    _memory = _getMemorySpace()
+    if not _memory then
+        return
+    end
+
+    -- Without write taps, and on audit frames, every channel is dirty.
+    _framesSinceAudit = _framesSinceAudit + 1
+    if not _tapsActive or _framesSinceAudit >= TAP_AUDIT_INTERVAL then
+        _dirtyChannels = STATE_CHANNELS
+        _framesSinceAudit = 0
+    end
+
+    if _settle and _stepOpen and not _stepOpenedByBoot then
+        _watchSettle()
+    end
+
+    -- Skip frames that aren't multiples of the sampling rate
+    if _framesElapsed % _frameSamplingRate ~= 0 then
+        return
+    end
+
+    -- Readiness gate: only sample during live play (LOOK or EXAMINE).
+    local live = _isLive()
+    if live then
+        _reachedLive = true
+    end
+
+    -- Fixed-length steps hold their changes for the step end.
+    if live and _framesPerStep == 0 then
+        _writeChangedChannels()
+    end
+
+    -- Steps keep ending after live play stops (death, the win), so a
+    -- reader waiting on the step-ended event is never left waiting.
+    if _stepOpen and _reachedLive and _isStepDue() then
+        if live and _framesPerStep > 0 then
+            _writeChangedChannels()
+        end
+        _endStep()
+    end
+end
+
+-- Per-frame notifier: number the frame, then write its envelope, empty or
+-- not, so the reader can tell a quiet frame from a lost one.
+local function _onFrame()
+    _framesElapsed = _framesElapsed + 1
+
+    if manager.machine.paused then
+        return
+    end
+
+    _frameNumber = (_frameNumber + 1) & U32_MAX
+    _sampleFrame()
+    _writeMessage()
 end
 
 -- Public: start watching game state.
 function state.beginWatching(stateFile, config)
     _stateFile = stateFile
     _framesElapsed = 0
+    _frameNumber = 0
     _memory = nil
-    _stateSnapshot = nil
-    _pixelSnapshot = nil
-    _comColorSnapshot = nil
-    _mazeSnapshot = nil
-    _creatureSnapshot = nil
-    _objectSnapshot = nil
-    _holesLaddersSnapshot = nil
+    _removeTaps()
+    _tapsInstalled = false
+    _framesSinceAudit = 0
+    _clearSnapshots()
+    _resetClock()
+
+    _commandNotifierCalls = config and config.command_notifier_calls
+    _lockstep = (config and config.lockstep) or false
+    _framesPerStep = (config and config.frames_per_step) or 0
+    _settle = (config and config.settle) or false
+    _sharedFile = config and config.shared_state_file
+    _openStep(true, false)
+    _reachedLive = false
+
+    _samplingRates = {}
+    _floorChannels = 0
+    for name, channel in pairs(SAMPLING_CHANNELS) do
+        local rate = (config and config.sampling_rates and config.sampling_rates[name]) or 1
+        _samplingRates[channel] = rate
+        if rate == ON_FLOOR_CHANGE then
+            _floorChannels = _floorChannels | channel
+        end
+    end
 
     if config and config.frame_sampling_rate then
         _frameSamplingRate = config.frame_sampling_rate
@@ -486,17 +1198,45 @@ function state.beginWatching(stateFile, config)
     _frameSubscription = emu.add_machine_frame_notifier(_onFrame)
 end
 
+-- Public: commands.lua dispatched the next step; count its frames from here.
+function state.beginStep(typed)
+    _openStep(false, typed)
+end
+
 -- Public: clear machine references so the next frame re-acquires them.
 -- MAME rebuilds the machine on reset, invalidating the cached memory space.
+-- The reset event opens a new epoch: everything after it is a new boot, and
+-- the write taps are reinstalled on the rebuilt machine.
 function state.onReset()
     _memory = nil
-    _stateSnapshot = nil
-    _pixelSnapshot = nil
-    _comColorSnapshot = nil
-    _mazeSnapshot = nil
-    _creatureSnapshot = nil
-    _objectSnapshot = nil
-    _holesLaddersSnapshot = nil
+    _removeTaps()
+    _tapsInstalled = false
+    _clearSnapshots()
+    _resetClock()
+    _openStep(true, false)
+    _reachedLive = false
+    _advanceEpoch()
+    _queueEvent(EVENT_MACHINE_RESET)
+    _writeMessage()
+end
+
+-- Public: acknowledge a snapshot save. MAME writes the file right after the
+-- pre-save notification, before any later control opcode is read.
+function state.onSave()
+    _queueEvent(EVENT_SNAPSHOT_SAVED)
+    _writeMessage()
+end
+
+-- Public: acknowledge a snapshot load. The restored RAM matches none of the
+-- channel snapshots, so the next live frame sends every channel, in a new
+-- epoch.
+function state.onLoad()
+    _clearSnapshots()
+    _resetClock()
+    _openStep(true, false)
+    _advanceEpoch()
+    _queueEvent(EVENT_SNAPSHOT_LOADED)
+    _writeMessage()
 end
 
 return state
\ No newline at end of file
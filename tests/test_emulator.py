@@ -17,19 +17,35 @@ Growth plan:
 """
 
 import os
+import select
 import sys
+import time
 import importlib
 
+import struct
+import threading
+
 import numpy as np
+import pytest
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Force-reload to bypass stale editable-install cache
 import daggorath_gym
 importlib.reload(daggorath_gym)
-from daggorath_gym.emulator import MameOperator, IpcConfig
+from daggorath_gym.emulator import MameOperator, IpcConfig, MameConfig, SamplingRates
+from daggorath_gym.emulator import (
+    _CHANNEL_CLOCK,
+    _CHANNEL_FRAME,
+    _CHANNEL_MAZE,
+    _EVENT_MACHINE_RESET,
+    _SHARED_CHANNEL_OFFSETS,
+    _SHARED_HEADER,
+)
 from daggorath_gym.state import (
     CREATURE_FIELDS,
+    FRAME_LEN,
+    MAZE_BYTES,
     CREATURE_SLOTS,
     FIELDS,
     FLOOR_OBJECT_CAPACITY,
@@ -45,6 +61,25 @@ from daggorath_gym.state import (
 
 # Each test gets its own FIFO path to avoid collisions.
 _IPC = IpcConfig(state_fifo_path="/tmp/daggorath-test-emulator", command_port=15101)
+_IPC_SNAPSHOT = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-emulator-snapshot", command_port=15102
+)
+_IPC_TRAINING = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-emulator-training", command_port=15103
+)
+_IPC_LOCKSTEP = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-emulator-lockstep", command_port=15104, lockstep=True
+)
+_IPC_SHARED = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-emulator-shared",
+    command_port=15105,
+    shared_state_path="/tmp/daggorath-test-emulator-shared.bin",
+)
+_IPC_REDUCED = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-emulator-reduced",
+    command_port=15106,
+    sampling_rates=SamplingRates.reduced(),
+)
 
 
 def test_operator_starts_and_stops():
@@ -116,4 +151,355 @@ def test_world_channels_arrive_and_decode():
         # must not be all sentinel — a pointer-walk bug would empty it.
         assert np.any(state.holes_ladders[..., 0] != 0xFF)
     finally:
-        operator.stop()
\ No newline at end of file
+        operator.stop()
+
+def test_snapshot_load_resends_every_channel():
+    """After a snapshot load the plugin re-sends the frame and all world channels."""
+    operator = MameOperator(ipc_config=_IPC_SNAPSHOT)
+    try:
+        operator.start()
+        operator.recv()
+        operator.save_snapshot(0)
+        operator.load_snapshot(0)
+
+        state = None
+        for _ in range(5):
+            state = operator.recv()
+        assert state.game_mode in (0x00, 0xFF)
+        assert state.maze is not None
+        assert state.creatures is not None
+        assert state.hands is not None
+        assert state.holes_ladders is not None
+    finally:
+        operator.stop()
+
+
+def test_shared_state_delivers_every_channel():
+    """With a shared-state file, recv() reads the frame and world channels from it."""
+    operator = MameOperator(ipc_config=_IPC_SHARED)
+    try:
+        operator.start()
+        state = operator.recv()
+        assert state.game_mode in (0x00, 0xFF)
+        assert state.maze is not None
+        assert state.creatures is not None
+        assert state.hands is not None
+        assert state.holes_ladders is not None
+    finally:
+        operator.stop()
+    assert not os.path.exists(_IPC_SHARED.shared_state_path)
+
+
+def test_reduced_sampling_still_delivers_every_channel():
+    """Channels sampled every N frames, or on floor changes, still arrive from the first live frame."""
+    operator = MameOperator(ipc_config=_IPC_REDUCED)
+    try:
+        operator.start()
+        state = operator.recv()
+        assert state.maze is not None
+        assert state.creatures is not None
+        assert state.hands is not None
+        assert state.holes_ladders is not None
+    finally:
+        operator.stop()
+
+
+def test_sampling_rates_reject_negative_rates():
+    """A channel's sampling rate is a frame count, or 0 for floor changes."""
+    assert SamplingRates(maze=SamplingRates.ON_FLOOR_CHANGE).maze == 0
+    with pytest.raises(ValueError):
+        SamplingRates(objects=-1)
+
+
+def test_training_profile_runs_faster_than_real_time():
+    """The headless, unthrottled profile outpaces 60 Hz without starving the notifiers."""
+    operator = MameOperator(mame_config=MameConfig.training(), ipc_config=_IPC_TRAINING)
+    try:
+        operator.start()
+        while operator.emulated_fps is None:
+            operator.recv()
+        assert operator.emulated_fps > 60
+        assert operator.missed_notifier_frames == 0
+    finally:
+        operator.stop()
+
+
+def test_lockstep_pauses_between_steps():
+    """In lockstep the plugin writes nothing while paused, and advance() runs one step."""
+    operator = MameOperator(ipc_config=_IPC_LOCKSTEP)
+    try:
+        operator.start()
+        operator.recv_step()
+
+        time.sleep(1.0)
+        readable, _, _ = select.select([operator._state_fd], [], [], 0)
+        assert not readable
+
+        operator.advance()
+        state = operator.recv_step()
+        assert state.game_mode == 0x00
+    finally:
+        operator.stop()
+
+
+def _envelope(frame, channels=(), epoch=0, events=0):
+    """Build one state-channel envelope from (channel bit, payload) pairs."""
+    mask = 0
+    for channel, _ in channels:
+        mask |= channel
+    payload = b"".join(payload for _, payload in sorted(channels))
+    header = struct.pack("<2sBBIHHH", b"DG", 2, events, frame, epoch, mask, len(payload))
+    checksum = (sum(header) + sum(payload)) & 0xFFFF
+    return header + struct.pack("<H", checksum) + payload
+
+
+def test_clock_report_gives_rate_and_missed_frames():
+    """A clock report yields frames per second and counts frames a notifier missed."""
+    operator = MameOperator()
+    operator._apply_clock(struct.pack("<IIII", 600, 600, 598, 1_000_000))
+    assert operator.emulated_fps == 600
+    assert operator.missed_notifier_frames == 2
+
+
+def test_settle_report_gives_match_and_frame_cap():
+    """A settle report's flags say whether the command matched and whether the cap hit."""
+    operator = MameOperator()
+    operator._apply_settled(bytes([0x01]))
+    assert operator.command_matched is True
+    assert operator.settle_timed_out is False
+    operator._apply_settled(bytes([0x02]))
+    assert operator.command_matched is False
+    assert operator.settle_timed_out is True
+
+
+def test_receive_buffer_reassembles_envelopes_split_across_reads():
+    """Envelopes written in odd-sized pieces come back whole, in order, across buffer reuse."""
+    read_fd, write_fd = os.pipe()
+    envelopes = []
+    for number in range(200):
+        envelopes.append(_envelope(2 * number + 1, [(_CHANNEL_FRAME, bytes([number % 256]) * FRAME_LEN)]))
+        envelopes.append(_envelope(2 * number + 2, [(_CHANNEL_MAZE, bytes([(number * 7) % 256]) * MAZE_BYTES)]))
+    stream = b"".join(envelopes)
+
+    def write_in_pieces():
+        for offset in range(0, len(stream), 777):
+            os.write(write_fd, stream[offset:offset + 777])
+        os.close(write_fd)
+
+    operator = MameOperator()
+    operator._state_fd = read_fd
+    writer = threading.Thread(target=write_in_pieces)
+    writer.start()
+    try:
+        for number in range(200):
+            state = operator.recv()
+            assert state.game_mode == number % 256
+            state = operator.recv()
+            assert np.all(state.maze == (number * 7) % 256)
+        assert operator.dropped_frames == 0
+        assert operator.discarded_bytes == 0
+    finally:
+        writer.join()
+        os.close(read_fd)
+
+
+def test_recv_latest_folds_every_queued_envelope():
+    """recv_latest() drains the FIFO and builds one state from everything queued."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.write(write_fd, b"".join([
+        _envelope(1, [(_CHANNEL_FRAME, bytes([1]) * FRAME_LEN)]),
+        _envelope(2, [(_CHANNEL_MAZE, bytes([9]) * MAZE_BYTES)]),
+        _envelope(3, [(_CHANNEL_CLOCK, struct.pack("<IIII", 60, 60, 60, 1_000_000))]),
+        _envelope(4, [(_CHANNEL_FRAME, bytes([2]) * FRAME_LEN)]),
+    ]))
+
+    operator = MameOperator()
+    operator._state_fd = read_fd
+    try:
+        state, coalesced = operator.recv_latest()
+        assert coalesced == 3
+        assert state.game_mode == 2
+        assert np.all(state.maze == 9)
+        assert operator.emulated_fps == 60
+    finally:
+        os.close(write_fd)
+        os.close(read_fd)
+
+
+def test_envelopes_report_dropped_frames_and_lag():
+    """Frame gaps count as dropped, and envelopes queued behind a state count as lag."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.write(write_fd, b"".join([
+        _envelope(1, [(_CHANNEL_FRAME, bytes([1]) * FRAME_LEN)]),
+        _envelope(4, [(_CHANNEL_FRAME, bytes([2]) * FRAME_LEN)]),
+        _envelope(5),
+        _envelope(6),
+    ]))
+
+    operator = MameOperator()
+    operator._state_fd = read_fd
+    try:
+        assert operator.recv().game_mode == 1
+        assert operator.observation_lag == 5
+        assert operator.recv().game_mode == 2
+        assert operator.dropped_frames == 2
+        assert operator.observation_lag == 2
+    finally:
+        os.close(write_fd)
+        os.close(read_fd)
+
+
+def test_corrupt_bytes_are_skipped_to_the_next_envelope():
+    """Garbage and a failed checksum are discarded, and reading resumes at the next envelope."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    corrupt = bytearray(_envelope(2, [(_CHANNEL_FRAME, bytes([2]) * FRAME_LEN)]))
+    corrupt[-1] ^= 0xFF
+    os.write(write_fd, b"".join([
+        b"xyz",
+        _envelope(1, [(_CHANNEL_FRAME, bytes([1]) * FRAME_LEN)]),
+        bytes(corrupt),
+        _envelope(3, [(_CHANNEL_FRAME, bytes([3]) * FRAME_LEN)]),
+    ]))
+
+    operator = MameOperator()
+    operator._state_fd = read_fd
+    try:
+        assert operator.recv().game_mode == 1
+        assert operator.recv().game_mode == 3
+        assert operator.discarded_bytes == 3 + len(corrupt)
+        assert operator.dropped_frames == 1
+    finally:
+        os.close(write_fd)
+        os.close(read_fd)
+
+
+def test_new_epoch_forgets_the_last_known_state():
+    """An envelope from a new epoch drops every channel the reader knew."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.write(write_fd, b"".join([
+        _envelope(1, [
+            (_CHANNEL_FRAME, bytes([1]) * FRAME_LEN),
+            (_CHANNEL_MAZE, bytes([9]) * MAZE_BYTES),
+        ]),
+        _envelope(0, epoch=1, events=_EVENT_MACHINE_RESET),
+        _envelope(1, [(_CHANNEL_FRAME, bytes([2]) * FRAME_LEN)], epoch=1),
+    ]))
+
+    operator = MameOperator()
+    operator._state_fd = read_fd
+    try:
+        assert operator.recv().maze is not None
+        state = operator.recv()
+        assert state.game_mode == 2
+        assert state.maze is None
+        assert operator.dropped_frames == 0
+    finally:
+        os.close(write_fd)
+        os.close(read_fd)
+
+
+def test_backpressure_counts_a_pipe_left_nearly_full():
+    """A sized pipe is sampled before each read, and filling it counts as one stall."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+
+    operator = MameOperator(ipc_config=IpcConfig(pipe_capacity=8192))
+    operator._state_fd = read_fd
+    try:
+        operator._pipe_capacity = operator._size_state_fifo()
+        assert operator.backpressure.capacity_bytes == 8192
+
+        frame = 1
+        try:
+            while True:
+                os.write(write_fd, _envelope(frame, [(_CHANNEL_FRAME, bytes([1]) * FRAME_LEN)]))
+                frame += 1
+        except BlockingIOError:
+            pass
+
+        operator.recv_latest()
+        stats = operator.backpressure
+        assert stats.stall_events == 1
+        assert stats.high_water_bytes > 8192 - 4096
+        assert stats.queued_bytes == stats.high_water_bytes
+
+        os.write(write_fd, _envelope(frame, [(_CHANNEL_FRAME, bytes([2]) * FRAME_LEN)]))
+        operator.recv_latest()
+        stats = operator.backpressure
+        assert stats.stall_events == 1
+        assert stats.queued_bytes < stats.high_water_bytes
+    finally:
+        os.close(write_fd)
+        os.close(read_fd)
+
+
+def _write_shared_state(path, sequence, epoch, data_epoch, generations, channels):
+    """Write a shared-state header, and the given channels at their offsets."""
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, _SHARED_HEADER.pack(sequence, epoch, data_epoch, *generations), 0)
+        for channel, payload in channels.items():
+            os.pwrite(fd, payload, _SHARED_CHANNEL_OFFSETS[channel])
+    finally:
+        os.close(fd)
+
+
+def test_shared_state_copies_only_changed_channels():
+    """The shared-state reader folds in the channels whose generation moved."""
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    path = "/tmp/daggorath-test-emulator-shared-unit.bin"
+
+    operator = MameOperator(
+        ipc_config=IpcConfig(state_fifo_path="/tmp/unused", shared_state_path=path)
+    )
+    operator._state_fd = read_fd
+    operator._shared_state = operator._create_shared_state()
+    try:
+        _write_shared_state(path, 4, 1, 1, (1, 0, 1, 0, 0, 0), {
+            0: bytes([1]) * FRAME_LEN,
+            2: bytes([9]) * MAZE_BYTES,
+        })
+        state, writes = operator.recv_latest()
+        assert writes == 2
+        assert state.game_mode == 1
+        assert np.all(state.maze == 9)
+
+        _write_shared_state(path, 6, 1, 1, (2, 0, 1, 0, 0, 0), {
+            0: bytes([2]) * FRAME_LEN,
+        })
+        state = operator.recv()
+        assert state.game_mode == 2
+        assert np.all(state.maze == 9)
+    finally:
+        operator._shared_state.close()
+        os.unlink(path)
+        os.close(write_fd)
+        os.close(read_fd)
+
+
+def test_shared_state_ignores_channels_from_before_a_reset():
+    """Channels written in an earlier epoch, or an unchanged file, read as nothing new."""
+    path = "/tmp/daggorath-test-emulator-shared-epoch.bin"
+    operator = MameOperator(
+        ipc_config=IpcConfig(state_fifo_path="/tmp/unused", shared_state_path=path)
+    )
+    operator._shared_state = operator._create_shared_state()
+    try:
+        assert operator._read_shared_state() == 0
+
+        _write_shared_state(path, 8, 2, 1, (1, 1, 1, 1, 1, 1), {0: bytes([3]) * FRAME_LEN})
+        assert operator._read_shared_state() == 0
+        assert operator._last_frame is None
+
+        _write_shared_state(path, 10, 2, 2, (2, 1, 1, 1, 1, 1), {0: bytes([4]) * FRAME_LEN})
+        assert operator._read_shared_state() == 5
+        assert operator._last_frame == bytes([4]) * FRAME_LEN
+    finally:
+        operator._shared_state.close()
+        os.unlink(path)
@@ -21,6 +21,7 @@ import sys
 import importlib
 
 import numpy as np
+import pytest
 from gymnasium import spaces
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -30,13 +31,29 @@ import daggorath_gym
 importlib.reload(daggorath_gym)
 from daggorath_gym.commands import NUM_OBJECT_SPECIFIERS, NUM_TEMPLATES
 from daggorath_gym.emulator import IpcConfig
-from daggorath_gym.environment import DaggorathEnv
+from daggorath_gym.environment import Checkpoint, DaggorathEnv
 from daggorath_gym.state import FIELDS, FRAME_LEN, OBJECTS_BYTES, DaggorathState
 
 _IPC = IpcConfig(state_fifo_path="/tmp/daggorath-test-env", command_port=15201)
 _IPC_CONTRACT = IpcConfig(
     state_fifo_path="/tmp/daggorath-test-env-contract", command_port=15203
 )
+_IPC_SNAPSHOT = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-env-snapshot", command_port=15204
+)
+_IPC_RESTART = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-env-restart", command_port=15205
+)
+_IPC_CHECKPOINT = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-env-checkpoint", command_port=15206
+)
+_IPC_FIXED_STEPS = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-env-fixed-steps", command_port=15207, frames_per_step=30
+)
+_IPC_SETTLE = IpcConfig(
+    state_fifo_path="/tmp/daggorath-test-env-settle", command_port=15208, settle=True
+)
+_IPC_POOL = IpcConfig(state_fifo_path="/tmp/daggorath-test-env-pool", command_port=15210)
 
 
 def test_reset_returns_valid_observation():
@@ -59,6 +76,95 @@ def test_close_cleans_up():
     env.close()
 
 
+def test_snapshot_reset_reuses_the_emulator():
+    """Snapshot-mode reset() restores in the running MAME instead of relaunching."""
+    env = DaggorathEnv(ipc_config=_IPC_SNAPSHOT, reset_mode="snapshot")
+    try:
+        first_observation, _ = env.reset()
+        emulator = env._emulator
+        second_observation, _ = env.reset()
+
+        assert env._emulator is emulator
+        assert env.observation_space.contains(first_observation)
+        assert env.observation_space.contains(second_observation)
+    finally:
+        env.close()
+
+
+def test_restart_reset_reuses_the_emulator():
+    """Restart-mode reset() soft-resets the running MAME and reaches live play again."""
+    env = DaggorathEnv(ipc_config=_IPC_RESTART, reset_mode="restart")
+    try:
+        env.reset()
+        emulator = env._emulator
+        observation, _ = env.reset()
+
+        assert env._emulator is emulator
+        assert env.observation_space.contains(observation)
+    finally:
+        env.close()
+
+
+def test_pooled_reset_swaps_in_a_booted_emulator():
+    """With a warm pool, each reset() takes a different, already-live emulator."""
+    env = DaggorathEnv(ipc_config=_IPC_POOL, pool_size=1)
+    try:
+        env.reset()
+        emulator = env._emulator
+        observation, _ = env.reset()
+
+        assert env._emulator is not emulator
+        assert env.observation_space.contains(observation)
+    finally:
+        env.close()
+
+
+def test_restore_returns_to_the_checkpoint():
+    """restore() rewinds the running game to a snapshot(), more than once."""
+    env = DaggorathEnv(ipc_config=_IPC_CHECKPOINT)
+    try:
+        env.reset()
+        checkpoint = env.snapshot()
+        for _ in range(3):
+            env.step(np.array([0, 0]))
+
+        for _ in range(2):
+            observation, _ = env.restore(checkpoint)
+            assert env.current_state is checkpoint.current_state
+            assert env.observation_space.contains(observation)
+            env.step(np.array([0, 0]))
+    finally:
+        env.close()
+
+
+def test_fixed_frame_steps_return_the_step_end_state():
+    """With frames_per_step, every step() returns once its frames have run."""
+    env = DaggorathEnv(ipc_config=_IPC_FIXED_STEPS)
+    try:
+        env.reset()
+        # A typed command, then an invalid INCANT that only advances.
+        for action in ([0, 0], [25, 1]):
+            observation, _, _, _, _ = env.step(np.array(action))
+            assert env.observation_space.contains(observation)
+    finally:
+        env.close()
+
+
+def test_settled_steps_resolve_one_command_each():
+    """In settle mode a typed command's step ends matched; an advance's ends unmatched."""
+    env = DaggorathEnv(ipc_config=_IPC_SETTLE)
+    try:
+        env.reset()
+        _, _, _, _, info = env.step(np.array([0, 0]))  # MOVE
+        assert info["command_matched"] is True
+        assert info["settle_timed_out"] is False
+
+        _, _, _, _, info = env.step(np.array([25, 1]))  # invalid INCANT: advance
+        assert info["command_matched"] is False
+    finally:
+        env.close()
+
+
 def test_gymnasium_consumer_contract():
     """The Gymnasium surface a consumer touches before training is coherent.
 
@@ -150,6 +256,46 @@ def test_not_terminated():
     assert env._check_terminated(state) is False
 
 
+def test_rejects_unknown_reset_mode():
+    """An unknown reset mode fails at construction, not at the first reset()."""
+    with pytest.raises(ValueError):
+        DaggorathEnv(reset_mode="reboot")
+
+
+def test_rejects_pool_without_relaunch():
+    """A warm pool only replaces relaunching, so other reset modes refuse it."""
+    with pytest.raises(ValueError):
+        DaggorathEnv(reset_mode="snapshot", pool_size=2)
+
+
+def test_restore_rejects_a_stale_checkpoint():
+    """A checkpoint whose slot no longer holds it cannot be restored."""
+    env = DaggorathEnv()
+    state = DaggorathState(_build_frame())
+    checkpoint = Checkpoint(slot=1, generation=0, reconstruction=None, current_state=state)
+    with pytest.raises(ValueError):
+        env.restore(checkpoint)
+
+
+def test_marked_steps_follow_lockstep_or_frame_count():
+    """The plugin marks step ends in lockstep or with a frame count, not free-running."""
+    assert not IpcConfig().marks_steps
+    assert IpcConfig(lockstep=True).marks_steps
+    assert IpcConfig(frames_per_step=4).marks_steps
+
+
+def test_settle_excludes_fixed_frame_steps():
+    """A step cannot both last a fixed frame count and wait for its command."""
+    with pytest.raises(ValueError):
+        IpcConfig(frames_per_step=30, settle=True)
+
+
+def test_rejects_latest_receive_with_marked_steps():
+    """Marked steps fold their own records, so "latest" receive mode refuses them."""
+    with pytest.raises(ValueError):
+        DaggorathEnv(ipc_config=IpcConfig(lockstep=True), receive_mode="latest")
+
+
 def test_not_truncated():
     """The environment never truncates on its own."""
     env = DaggorathEnv()
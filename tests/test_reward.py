@@ -179,6 +179,21 @@ def test_reset_clears_memory():
     assert reward._information_gain(cell_state, (3,)) == pytest.approx(1.0)
 
 
+def test_restore_memory_rewinds_novelty():
+    """restore_memory() forgets what was learned after save_memory()."""
+    reward = DaggorathReward()
+    first_cell = DaggorathState(_build_frame(at_cell_x=1, at_cell_y=1))
+    second_cell = DaggorathState(_build_frame(at_cell_x=2, at_cell_y=1))
+    reward._information_gain(first_cell, ())
+    memory = reward.save_memory()
+    reward._information_gain(second_cell, (3,))
+    reward.restore_memory(memory)
+    assert reward._information_gain(first_cell, ()) == 0.0
+    assert reward._information_gain(second_cell, (3,)) == pytest.approx(
+        _ADVANCE_REWARD + 1.0
+    )
+
+
 # ---- reject penalty -------------------------------------------------------
 
 def test_reject_penalty_edge_detected():
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""Benchmark episode-reset latency across the environment's reset strategies.
+
+Compares relaunching MAME, restoring a snapshot, soft-resetting, and taking
+an instance from a warm pool. Requires MAME on PATH and the ROMs in
+emulation/roms/. Each strategy gets its own environment; the first reset()
+(the boot) is reported separately from the steady-state resets after it.
+
+    python tools/benchmark_reset.py --resets 10 --pool-size 2
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daggorath_gym.emulator import IpcConfig, MameConfig
+from daggorath_gym.environment import DaggorathEnv
+
+
+def time_resets(label, resets, command_port, **env_options):
+    """Return the wall-clock seconds of each reset() for one reset strategy."""
+    env = DaggorathEnv(
+        mame_config=MameConfig(sound="none", window=False),
+        ipc_config=IpcConfig(
+            state_fifo_path=f"/tmp/daggorath-benchmark-{label}",
+            command_port=command_port,
+        ),
+        **env_options,
+    )
+    durations = []
+    try:
+        for _ in range(resets + 1):
+            started = time.perf_counter()
+            env.reset()
+            durations.append(time.perf_counter() - started)
+    finally:
+        env.close()
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resets", type=int, default=5,
+                        help="steady-state resets to time per strategy (after the boot)")
+    parser.add_argument("--pool-size", type=int, default=2,
+                        help="pre-booted instances for the warm-pool strategy")
+    arguments = parser.parse_args()
+
+    strategies = {
+        "relaunch": {"reset_mode": "relaunch"},
+        "snapshot": {"reset_mode": "snapshot"},
+        "restart": {"reset_mode": "restart"},
+        "pool": {"reset_mode": "relaunch", "pool_size": arguments.pool_size},
+    }
+
+    # Space the command ports so a pool's per-instance ports never collide.
+    results = {}
+    for number, (label, env_options) in enumerate(strategies.items()):
+        command_port = 15300 + number * 20
+        results[label] = time_resets(label, arguments.resets, command_port, **env_options)
+
+    print(f"{'strategy':<10} {'boot':>8} {'mean':>8} {'min':>8} {'max':>8}   (seconds)")
+    for label, durations in results.items():
+        boot, steady = durations[0], durations[1:]
+        print(
+            f"{label:<10} {boot:8.3f} {statistics.mean(steady):8.3f} "
+            f"{min(steady):8.3f} {max(steady):8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
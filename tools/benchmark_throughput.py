@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Benchmark the emulation rate with the state channel under full load.
+
+Runs the headless, unthrottled training profile and keeps the state FIFO
+drained with recv_latest(), so the plugin never waits on the reader. Reports
+the emulated frames per second from the plugin's clock reports, with the
+frames each envelope stream lost. Requires MAME on PATH and the ROMs in
+emulation/roms/. Run it before and after a change to state.lua to see what
+the change costs the emulator thread. Each sampling profile (the channel
+sampling rates in IpcConfig) gets its own run, so their rates compare
+directly.
+
+    python tools/benchmark_throughput.py --seconds 30 --sampling every-frame reduced
+"""
+
+import argparse
+import dataclasses
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daggorath_gym.emulator import IpcConfig, MameConfig, MameOperator, SamplingRates
+
+SAMPLING_PROFILES = {
+    "every-frame": SamplingRates(),
+    "reduced": SamplingRates.reduced(),
+}
+
+
+def sample_rates(seconds, mame_config, ipc_config):
+    """Return the emulated-FPS readings taken over the given wall-clock seconds."""
+    operator = MameOperator(mame_config=mame_config, ipc_config=ipc_config)
+    rates = []
+    try:
+        operator.start()
+        operator.recv()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            before = operator.emulated_fps
+            operator.recv_latest()
+            if operator.emulated_fps is not None and operator.emulated_fps != before:
+                rates.append(operator.emulated_fps)
+        return rates, operator.missed_notifier_frames, operator.dropped_frames
+    finally:
+        operator.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=20,
+                        help="wall-clock seconds to run after the first live state")
+    parser.add_argument("--frameskip", type=int, default=None,
+                        help="MAME frameskip to run with (default: none)")
+    parser.add_argument("--sampling", nargs="+", choices=SAMPLING_PROFILES,
+                        default=list(SAMPLING_PROFILES),
+                        help="channel sampling profiles to run (default: all)")
+    arguments = parser.parse_args()
+
+    mame_config = dataclasses.replace(MameConfig.training(), frameskip=arguments.frameskip)
+    print(f"{'sampling':<12} {'readings':>8} {'mean':>8} {'min':>8} {'max':>8} "
+          f"{'missed':>8} {'dropped':>8}   (emulated frames per second)")
+    for number, label in enumerate(arguments.sampling):
+        ipc_config = IpcConfig(
+            state_fifo_path=f"/tmp/daggorath-benchmark-throughput-{label}",
+            command_port=15400 + number,
+            sampling_rates=SAMPLING_PROFILES[label],
+        )
+        rates, missed, dropped = sample_rates(arguments.seconds, mame_config, ipc_config)
+        if not rates:
+            print(f"{label:<12} no clock report arrived; run for longer")
+            continue
+        print(f"{label:<12} {len(rates):8d} {statistics.mean(rates):8.1f} {min(rates):8.1f} "
+              f"{max(rates):8.1f} {missed:8d} {dropped:8d}")
+
+
+if __name__ == "__main__":
+    main()